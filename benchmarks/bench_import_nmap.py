@@ -0,0 +1,50 @@
+## Time importing a large generated nmap report into a notebook.
+##
+## usage: python benchmarks/bench_import_nmap.py [hosts...]
+import argparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from PyQt5.QtWidgets import QApplication, QFileDialog
+import nmapxml
+import redteamnotebook
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark nmap import')
+  parser.add_argument('hosts', nargs='*', type=int, default=[1000, 5000])
+  parser.add_argument('--ports', type=int, default=10, help='ports per host')
+  parser.add_argument('--merge', action='store_true', help='also time merging the report back into itself')
+  args = parser.parse_args()
+
+  app = QApplication(sys.argv)
+  workdir = tempfile.mkdtemp()
+  try:
+    for hosts in args.hosts:
+      filename = os.path.join(workdir, f'{hosts}.xml')
+      nmapxml.write_report(filename, hosts, args.ports)
+      window = redteamnotebook.MainWindow(os.path.join(workdir, f'{hosts}.notebook'))
+      window.add_root_node(name='scan')
+      QFileDialog.getOpenFileNames = lambda *a, **kw: ([filename], '')
+
+      for merge in [False, True] if args.merge else [False]:
+        start = time.perf_counter()
+        window.import_nmap(merge=merge)
+        ## the import runs in the background, wait for it to finish
+        while window.import_worker:
+          app.processEvents()
+        elapsed = time.perf_counter() - start
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+        mode = 'merge' if merge else 'import'
+        print(f'{mode:>6} {hosts:>8} hosts, {len(window.uuid_index):>8} nodes: {elapsed:8.3f}s, peak rss {rss} MB')
+      window.close()
+      window.deleteLater()
+      app.processEvents()
+  finally:
+    shutil.rmtree(workdir)
@@ -0,0 +1,65 @@
+## Time a cold open of synthetic notebooks.
+##
+## usage: python benchmarks/bench_load.py [sizes...]
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from PyQt5.QtWidgets import QApplication
+import redteamnotebook
+
+def build_catalog(path, size):
+  ## lay the nodes out like an nmap import: hosts -> protocol -> ports
+  os.mkdir(path)
+  os.mkdir(os.path.join(path, 'images'))
+  db = sqlite3.connect(os.path.join(path, 'catalog.sqlite'))
+  with open(os.path.join(redteamnotebook.APP_PATH, 'init.sql')) as fp:
+    db.executescript(fp.read())
+  nodes = []
+  notes = []
+  root = uuid.uuid4().hex
+  nodes.append((root, None, 'scan', 'folder.png'))
+  while len(nodes) < size:
+    host = uuid.uuid4().hex
+    nodes.append((host, root, f'10.0.{len(nodes) // 256 % 256}.{len(nodes) % 256}', 'os_linux.png'))
+    notes.append((host, '# notes\n\nsome text about this host\n'))
+    proto = uuid.uuid4().hex
+    nodes.append((proto, host, 'tcp', None))
+    for port in range(min(8, size - len(nodes))):
+      nodes.append((uuid.uuid4().hex, proto, f'{port + 20} tcp [open]', 'stat_green.png'))
+  db.executemany('INSERT INTO node_graph (nodeid, parentid, basename, icon) VALUES (?, ?, ?, ?)', nodes[:size])
+  db.executemany('INSERT INTO notes (nodeid, content) VALUES (?, ?)', notes)
+  db.commit()
+  db.close()
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark notebook cold open')
+  parser.add_argument('sizes', nargs='*', type=int, default=[10000, 50000, 100000])
+  args = parser.parse_args()
+
+  app = QApplication(sys.argv)
+  workdir = tempfile.mkdtemp()
+  try:
+    for size in args.sizes:
+      path = os.path.join(workdir, f'{size}.notebook')
+      build_catalog(path, size)
+      ## migrations run once, and are not part of the open being timed
+      redteamnotebook.notebook.init_notebook(path)
+
+      start = time.perf_counter()
+      window = redteamnotebook.MainWindow(path)
+      elapsed = time.perf_counter() - start
+      print(f'{size:>8} nodes: {elapsed:8.3f}s')
+      window.close()
+      window.deleteLater()
+      app.processEvents()
+  finally:
+    shutil.rmtree(workdir)
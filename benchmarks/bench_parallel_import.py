@@ -0,0 +1,45 @@
+## Time parsing many nmap reports with a growing number of worker processes.
+##
+## usage: python benchmarks/bench_parallel_import.py [--files N] [--hosts N]
+import argparse
+import concurrent.futures
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import importer
+import nmapxml
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark parallel nmap parsing')
+  parser.add_argument('--files', type=int, default=24, help='number of reports')
+  parser.add_argument('--hosts', type=int, default=2000, help='hosts per report')
+  parser.add_argument('--ports', type=int, default=10, help='ports per host')
+  args = parser.parse_args()
+
+  workdir = tempfile.mkdtemp()
+  try:
+    filenames = []
+    for i in range(args.files):
+      filenames.append(os.path.join(workdir, f'{i}.xml'))
+      nmapxml.write_report(filenames[-1], args.hosts, args.ports, offset=i * args.hosts, seed=i)
+
+    jobs = 1
+    while True:
+      start = time.perf_counter()
+      nodes = 0
+      with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        ## a single writer turns every parsed report into node records, like the gui does
+        for future in concurrent.futures.as_completed([pool.submit(importer.parse_file, f) for f in filenames]):
+          nodes += len(importer.scan_nodes(future.result(), 'parent'))
+      elapsed = time.perf_counter() - start
+      print(f'{jobs:>3} jobs: {elapsed:8.3f}s, {args.files * args.hosts / elapsed:10.0f} hosts/s, {nodes} nodes')
+      if jobs >= (os.cpu_count() or 1):
+        break
+      jobs = min(jobs * 2, os.cpu_count() or 1)
+  finally:
+    shutil.rmtree(workdir)
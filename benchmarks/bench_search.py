@@ -0,0 +1,64 @@
+## Time full text searches over a notebook with many notes.
+##
+## usage: python benchmarks/bench_search.py [--notes N]
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import catalog
+import notebook
+
+WORDS = ['ssh', 'http', 'apache', 'nginx', 'openssh', 'banner', 'admin', 'password', 'smb', 'ldap',
+  'kerberos', 'mysql', 'postgres', 'tomcat', 'jenkins', 'redis', 'ftp', 'telnet', 'rdp', 'vnc']
+
+def build_notes(path, count):
+  db = sqlite3.connect(os.path.join(path, 'catalog.sqlite'))
+  rand = random.Random(0)
+  nodes = []
+  notes = []
+  for i in range(count):
+    nodeid = uuid.uuid4().hex
+    nodes.append((nodeid, None, f'10.{i // 65536}.{i // 256 % 256}.{i % 256}', None))
+    words = [rand.choice(WORDS) for _ in range(rand.randint(20, 200))]
+    words.append(f'token{i}')
+    notes.append((nodeid, ' '.join(words)))
+  db.executemany('INSERT INTO node_graph (nodeid, parentid, basename, icon) VALUES (?, ?, ?, ?)', nodes)
+  db.executemany('INSERT INTO notes (nodeid, content) VALUES (?, ?)', notes)
+  ## new nodes are indexed in bulk, the way write_nodes does it
+  db.execute(catalog.SEARCH_INDEX_NEW)
+  db.commit()
+  db.close()
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark note search')
+  parser.add_argument('--notes', type=int, default=100000, help='number of notes')
+  args = parser.parse_args()
+
+  workdir = tempfile.mkdtemp()
+  try:
+    path = os.path.join(workdir, 'search.notebook')
+    notebook.init_notebook(path)
+    start = time.perf_counter()
+    build_notes(path, args.notes)
+    print(f'indexed {args.notes} notes in {time.perf_counter() - start:.2f}s')
+
+    Session = notebook.create_session(path)
+    db = Session()
+    for terms in ['token12345', 'openssh', 'jenkins password', '10.0.4', 'tomc', 'nothinglikethis']:
+      start = time.perf_counter()
+      for _ in range(10):
+        rows = catalog.search(db, terms)
+      elapsed = (time.perf_counter() - start) / 10
+      print(f'{terms!r:>20}: {len(rows):4} hits in {elapsed * 1000:7.2f} ms')
+    db.close()
+    notebook.close_engine(path)
+  finally:
+    shutil.rmtree(workdir)
@@ -0,0 +1,47 @@
+## Generate synthetic nmap xml reports for the import benchmarks.
+import random
+
+HEADER = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE nmaprun>
+<nmaprun scanner="nmap" args="nmap -sV -O -oX scan.xml 10.0.0.0/16" start="1600000000" startstr="" version="7.80" xmloutputversion="1.04">
+<scaninfo type="syn" protocol="tcp" numservices="1000" services="1-1000"/>
+<verbose level="0"/>
+<debugging level="0"/>
+'''
+
+FOOTER = '''<runstats><finished time="1600000100" timestr="" elapsed="100" summary="" exit="success"/><hosts up="{up}" down="0" total="{up}"/></runstats>
+</nmaprun>
+'''
+
+HOST = '''<host starttime="1600000000" endtime="1600000001"><status state="up" reason="echo-reply" reason_ttl="63"/>
+<address addr="{address}" addrtype="ipv4"/>
+<hostnames><hostname name="{hostname}" type="PTR"/></hostnames>
+<ports>{ports}</ports>
+<os><osmatch name="{osname}" accuracy="96" line="1"><osclass type="general purpose" vendor="{osvendor}" osfamily="{osfamily}" osgen="" accuracy="96"/></osmatch></os>
+</host>
+'''
+
+PORT = '''<port protocol="{protocol}" portid="{port}"><state state="{state}" reason="syn-ack" reason_ttl="63"/><service name="unknown" method="table" conf="3"/></port>'''
+
+OSES = [('Linux', 'Linux'), ('Windows', 'Microsoft'), ('FreeBSD', 'FreeBSD'), ('Mac OS X', 'Apple')]
+
+def write_report(path, hosts, ports_per_host=10, offset=0, seed=0):
+  rnd = random.Random(seed)
+  with open(path, 'w') as fp:
+    fp.write(HEADER)
+    for i in range(offset, offset + hosts):
+      ports = []
+      for port in sorted(rnd.sample(range(1, 10000), ports_per_host)):
+        protocol = 'udp' if port % 7 == 0 else 'tcp'
+        state = rnd.choice(['open', 'open', 'closed', 'filtered'])
+        ports.append(PORT.format(protocol=protocol, port=port, state=state))
+      osfamily, osvendor = OSES[i % len(OSES)]
+      fp.write(HOST.format(
+        address=f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}',
+        hostname=f'host{i}.example.com',
+        ports=''.join(ports),
+        osname=osfamily,
+        osvendor=osvendor,
+        osfamily=osfamily,
+      ))
+    fp.write(FOOTER.format(up=hosts))
@@ -1,5 +1,10 @@
+import collections
+import hashlib
+import re
+from collections import namedtuple
 from sqlalchemy import Column, String, Integer, Float, Boolean, ForeignKey
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy.orm import relationship, backref, aliased
+from sqlalchemy.sql import bindparam, exists, text
 from sqlalchemy.ext.declarative import declarative_base
 from base import Base
 
@@ -11,8 +16,225 @@ class NodeGraph(Base):
   icon = Column(String)
   mtime = Column(Float)
 
+## a plain node row, for building large batches without the orm overhead
+NodeRecord = namedtuple('NodeRecord', ['nodeid', 'parentid', 'basename', 'icon'])
+
+## notes larger than this are stored as chunks, so an edit only rewrites the chunks it touched
+CHUNK_THRESHOLD = 64 * 1024
+## chunks end on a paragraph break, once they are at least CHUNK_MIN long and the paragraph's
+## hash says so, or once they reach CHUNK_MAX. boundaries follow the content, so an edit early
+## in a note does not shift every chunk after it
+CHUNK_MIN = 4 * 1024
+CHUNK_MAX = 32 * 1024
+CHUNK_AVERAGE = 8
+
 class Note(Base):
   __tablename__ = "notes"
   nodeid = Column(String, ForeignKey("node_graph.nodeid", ondelete="CASCADE"), primary_key=True)
   content = Column(String)
   mtime = Column(Float)
+  ## space separated chunk hashes, in order, when content is stored in note_chunks
+  chunks = Column(String)
+
+class NoteChunk(Base):
+  __tablename__ = "note_chunks"
+  nodeid = Column(String, primary_key=True)
+  hash = Column(String, primary_key=True)
+  content = Column(String)
+
+## packed notebooks keep their images in the catalog, under the names notes refer to them by
+IMAGE_SCHEMA = """CREATE TABLE IF NOT EXISTS images (
+  name TEXT PRIMARY KEY ON CONFLICT IGNORE,
+  mtime FLOAT,
+  data BLOB
+)"""
+
+def content_hash(content):
+  return hashlib.md5(content.encode('utf-8')).hexdigest()
+
+def split_chunks(content):
+  ## returns [(hash, text)], or None if the note is small enough to store whole
+  if len(content) < CHUNK_THRESHOLD:
+    return None
+  chunks = []
+  current = []
+  size = 0
+  paragraphs = content.split('\n\n')
+  for i, paragraph in enumerate(paragraphs):
+    if i < len(paragraphs) - 1:
+      paragraph += '\n\n'
+    current.append(paragraph)
+    size += len(paragraph)
+    if size >= CHUNK_MAX or (size >= CHUNK_MIN and int(content_hash(paragraph)[:8], 16) % CHUNK_AVERAGE == 0):
+      chunks.append(''.join(current))
+      current = []
+      size = 0
+  chunks.append(''.join(current))
+  return [(content_hash(chunk), chunk) for chunk in chunks if chunk]
+
+def load_note(db, nodeid):
+  ## returns (content, chunk hashes), putting chunked notes back together
+  note = db.query(Note.content, Note.chunks).filter_by(nodeid=nodeid).first()
+  if not note:
+    return None, None
+  if not note.chunks:
+    return note.content, None
+  hashes = note.chunks.split()
+  chunks = dict(db.query(NoteChunk.hash, NoteChunk.content).filter_by(nodeid=nodeid))
+  return ''.join(chunks[h] for h in hashes), hashes
+
+## notes refer to their images as images/<name>
+IMAGE_REF = re.compile(r'\bimages/([\w-]+\.\w+)')
+
+def image_references(db):
+  ## returns {image name: set of nodeids whose notes use it}, from whole and chunked notes alike
+  references = collections.defaultdict(set)
+  for rows in (db.query(Note.nodeid, Note.content).filter(Note.content != None), db.query(NoteChunk.nodeid, NoteChunk.content)):
+    for nodeid, content in rows.yield_per(1000):
+      for name in IMAGE_REF.findall(content or ''):
+        references[name].add(nodeid)
+  return references
+
+def load_adjacency(db):
+  ## read the whole graph in one query and build the parent -> children adjacency
+  children = {}
+  for row in db.execute(NodeGraph.__table__.select()):
+    children.setdefault(row.parentid, []).append(NodeRecord(row.nodeid, row.parentid, row.basename, row.icon))
+  return children
+
+def load_tree(db):
+  children = load_adjacency(db)
+
+  ## walk the adjacency breadth-first, so parents always come before their children
+  nodes = list(children.get(None, []))
+  for node in nodes:
+    nodes.extend(children.get(node.nodeid, []))
+  return nodes
+
+def load_children(db, parentid=None):
+  ## fetch one level of the graph, flagging the nodes that have children of their own
+  child = aliased(NodeGraph)
+  has_children = exists().where(child.parentid == NodeGraph.nodeid)
+  return db.query(NodeGraph, has_children).filter(NodeGraph.parentid == parentid).all()
+
+## the ids of some nodes and everything below them. UNION drops ids already seen, so a parentid
+## cycle can't make it recurse forever
+SUBTREE = """WITH RECURSIVE subtree(nodeid) AS (
+  SELECT nodeid FROM node_graph WHERE nodeid IN :nodeids
+  UNION
+  SELECT node_graph.nodeid FROM node_graph JOIN subtree ON node_graph.parentid = subtree.nodeid
+)"""
+
+def delete_subtree(db, nodeid):
+  delete_subtrees(db, [nodeid])
+
+def delete_subtrees(db, nodeids):
+  ## three statements for every 500 subtrees, however large they are. notes go first, while the graph can still be walked
+  nodeids = list(nodeids)
+  for i in range(0, len(nodeids), 500):
+    batch = {'nodeids': nodeids[i:i+500]}
+    for table in ('notes', 'note_chunks', 'node_graph'):
+      db.execute(text(f'{SUBTREE} DELETE FROM {table} WHERE nodeid IN subtree').bindparams(bindparam('nodeids', expanding=True)), batch)
+
+## the text of a node's note, whether it is stored whole or in chunks. chunks are joined in the
+## order notes.chunks lists them, the way load_note does
+NOTE_TEXT = """coalesce((SELECT coalesce(notes.content, (SELECT group_concat(chunk, '') FROM (
+    SELECT note_chunks.content AS chunk FROM json_each('["' || replace(notes.chunks, ' ', '","') || '"]') AS chunk_list
+    JOIN note_chunks ON note_chunks.nodeid = notes.nodeid AND note_chunks.hash = chunk_list.value
+    ORDER BY chunk_list.key)))
+  FROM notes WHERE notes.nodeid = {nodeid}), '')"""
+
+## the search index shares rowids with node_graph. renames, deletes and note saves reach it
+## through triggers. new nodes are indexed in bulk by index_new_nodes, which is several times
+## faster than a trigger per row on large imports. VACUUM may renumber node_graph, so
+## anything that vacuums must call rebuild_search
+SEARCH_SCHEMA = [
+  'CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5(basename, content)',
+  """CREATE TRIGGER IF NOT EXISTS search_node_rename AFTER UPDATE OF basename ON node_graph BEGIN
+  UPDATE search SET basename = new.basename WHERE rowid = new.rowid;
+END""",
+  """CREATE TRIGGER IF NOT EXISTS search_node_delete AFTER DELETE ON node_graph BEGIN
+  DELETE FROM search WHERE rowid = old.rowid;
+END""",
+  f"""CREATE TRIGGER IF NOT EXISTS search_note_insert AFTER INSERT ON notes BEGIN
+  UPDATE search SET content = {NOTE_TEXT.format(nodeid='new.nodeid')} WHERE rowid = (SELECT rowid FROM node_graph WHERE nodeid = new.nodeid);
+END""",
+  f"""CREATE TRIGGER IF NOT EXISTS search_note_update AFTER UPDATE ON notes BEGIN
+  UPDATE search SET content = {NOTE_TEXT.format(nodeid='new.nodeid')} WHERE rowid = (SELECT rowid FROM node_graph WHERE nodeid = new.nodeid);
+END""",
+  """CREATE TRIGGER IF NOT EXISTS search_note_delete AFTER DELETE ON notes BEGIN
+  UPDATE search SET content = '' WHERE rowid = (SELECT rowid FROM node_graph WHERE nodeid = old.nodeid);
+END""",
+]
+
+SEARCH_REBUILD = [
+  'DELETE FROM search',
+  f"INSERT INTO search (rowid, basename, content) SELECT rowid, basename, {NOTE_TEXT.format(nodeid='node_graph.nodeid')} FROM node_graph",
+]
+
+SEARCH_INDEX_NEW = f"""INSERT INTO search (rowid, basename, content)
+SELECT rowid, basename, {NOTE_TEXT.format(nodeid='node_graph.nodeid')} FROM node_graph
+WHERE rowid > coalesce((SELECT rowid FROM search ORDER BY rowid DESC LIMIT 1), 0)"""
+
+## more matches than this are not ranked, as scoring them all would take too long
+RANK_LIMIT = 5000
+
+def index_new_nodes(db):
+  ## node_graph rowids only grow, so anything past the last indexed row is new
+  db.execute(SEARCH_INDEX_NEW)
+
+def rebuild_search(db):
+  for sql in SEARCH_REBUILD:
+    db.execute(sql)
+
+def search_query(terms):
+  ## match every word the user typed, the last one as a prefix since they may still be typing
+  words = re.findall(r'\S+', terms)
+  if not words:
+    return None
+  return ' '.join('"' + word.replace('"', '""') + '"' for word in words) + '*'
+
+def search(db, terms, limit=100):
+  ## returns (nodeid, basename, snippet) rows, best first. names count for more than notes.
+  ## a term that matches most of the notebook is returned unranked, and needs narrowing down
+  query = search_query(terms)
+  if not query:
+    return []
+  matches = db.execute(text('SELECT count(*) FROM (SELECT 1 FROM search WHERE search MATCH :query LIMIT :most)'), {'query': query, 'most': RANK_LIMIT + 1}).scalar()
+  order = 'ORDER BY bm25(search, 10.0, 1.0)' if matches <= RANK_LIMIT else ''
+  sql = text(f"""SELECT node_graph.nodeid, node_graph.basename, snippet(search, 1, '[', ']', '...', 8) AS snippet
+FROM search JOIN node_graph ON node_graph.rowid = search.rowid
+WHERE search MATCH :query {order} LIMIT :limit""")
+  return db.execute(sql, {'query': query, 'limit': limit}).fetchall()
+
+def ancestors(db, nodeid):
+  ## the path from a root node down to nodeid, inclusive. the rows are put in order here, as a
+  ## depth column would keep UNION from dropping the nodes of a parentid cycle
+  sql = text("""WITH RECURSIVE path(nodeid, parentid) AS (
+  SELECT nodeid, parentid FROM node_graph WHERE nodeid = :nodeid
+  UNION
+  SELECT node_graph.nodeid, node_graph.parentid FROM node_graph JOIN path ON node_graph.nodeid = path.parentid
+)
+SELECT nodeid, parentid FROM path""")
+  parents = dict(db.execute(sql, {'nodeid': nodeid}).fetchall())
+  path = []
+  while nodeid in parents and nodeid not in path:
+    path.append(nodeid)
+    nodeid = parents[nodeid]
+  return path[::-1]
+
+## what the tree filter matches, with the default the tree gives nodes that have no icon
+FILTER_FIELDS = {'basename': "basename", 'icon': "coalesce(icon, 'folder.png')"}
+
+def filter_paths(db, field, pattern, limit):
+  ## up to limit nodes whose field is LIKE pattern (with \ as the escape), and every ancestor
+  ## of them, so a lazily loaded tree can fetch the branches its filter has to see. returns
+  ## the nodeids and how many of them matched
+  sql = text(f"""WITH RECURSIVE path(nodeid, parentid, matched) AS (
+  SELECT * FROM (SELECT nodeid, parentid, 1 FROM node_graph WHERE {FILTER_FIELDS[field]} LIKE :pattern ESCAPE '\\' LIMIT :limit)
+  UNION
+  SELECT node_graph.nodeid, node_graph.parentid, 0 FROM node_graph JOIN path ON node_graph.nodeid = path.parentid
+)
+SELECT nodeid, max(matched) FROM path GROUP BY nodeid""")
+  rows = db.execute(sql, {'pattern': pattern, 'limit': limit}).fetchall()
+  return [nodeid for nodeid, _ in rows], sum(matched for _, matched in rows)
@@ -0,0 +1,223 @@
+## content addressed storage for the images pasted into notes
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import notebook
+
+## the mode open() gives new files, worked out when the first store is made
+file_mode = None
+file_mode_lock = threading.Lock()
+
+def new_file_mode():
+  ## the umask can only be read by setting it, which affects every thread, so it is read from
+  ## /proc where possible, and only once
+  global file_mode
+  with file_mode_lock:
+    if file_mode is None:
+      try:
+        with open('/proc/self/status') as fp:
+          umask = next(int(line.split()[1], 8) for line in fp if line.startswith('Umask:'))
+      except (OSError, StopIteration, ValueError, IndexError):
+        umask = os.umask(0o022)
+        os.umask(umask)
+      file_mode = 0o666 & ~umask
+  return file_mode
+
+class ImageStore():
+  ## images live in <notebook>/images, named by the md5 of their encoded bytes, so the
+  ## same image pasted twice is only written once. safe to use from several threads
+  packed = False
+
+  def __init__(self, path):
+    self.path = path
+    ## mkstemp makes files only we can read, so stored images are given the usual mode
+    self.mode = new_file_mode()
+    self.lock = threading.Lock()
+    self.writes = 0
+    self.bytes_written = 0
+    self.hits = 0
+    self.bytes_saved = 0
+
+  def put(self, data, ext='png'):
+    ## returns the image name relative to the notebook, the way notes refer to it
+    img_hash = hashlib.md5(data).hexdigest()
+    name = f'{img_hash}.{ext}'
+    target = os.path.join(self.path, name)
+    if os.path.exists(target):
+      with self.lock:
+        self.hits += 1
+        self.bytes_saved += len(data)
+      return f'images/{name}'
+
+    ## write to a private temp file and rename it into place, so a reader never sees half an
+    ## image and two writers of the same image can't trip over each other
+    fd, staging_file = tempfile.mkstemp(dir=self.path, prefix='.stage-', suffix='.'+ext)
+    try:
+      with os.fdopen(fd, 'wb') as fp:
+        fp.write(data)
+      os.chmod(staging_file, self.mode)
+      os.replace(staging_file, target)
+    except:
+      if os.path.exists(staging_file):
+        os.remove(staging_file)
+      raise
+    with self.lock:
+      self.writes += 1
+      self.bytes_written += len(data)
+    return f'images/{name}'
+
+  def get(self, name):
+    try:
+      with open(os.path.join(self.path, name), 'rb') as fp:
+        return fp.read()
+    except FileNotFoundError:
+      return None
+
+  def file(self, name):
+    ## a path other programs can open the image from
+    return os.path.join(self.path, name)
+
+  def names(self):
+    ## (name, size, mtime) of everything stored, including staging files
+    for entry in os.scandir(self.path):
+      if entry.is_file():
+        stat = entry.stat()
+        yield entry.name, stat.st_size, stat.st_mtime
+
+  def remove(self, name):
+    os.remove(os.path.join(self.path, name))
+
+  def close(self):
+    pass
+
+  def stats(self):
+    return f'{self.writes} images written ({self.bytes_written} bytes), {self.hits} duplicates skipped ({self.bytes_saved} bytes saved)'
+
+class PackedImageStore(ImageStore):
+  ## images kept as blobs in a packed notebook's catalog, so the notebook is a single file.
+  ## each thread gets its own connection. nothing is opened until it is needed, so a store
+  ## made in one process and used in another works too
+  packed = True
+
+  def __init__(self, path):
+    super(PackedImageStore, self).__init__(path)
+    self.local = threading.local()
+    self.connections = []
+    self.extract_path = None
+
+  def connection(self):
+    if not hasattr(self.local, 'connection'):
+      connection = sqlite3.connect(notebook.catalog_file(self.path), timeout=30, check_same_thread=False)
+      notebook.set_pragmas(connection, None)
+      self.local.connection = connection
+      with self.lock:
+        self.connections.append(connection)
+    return self.local.connection
+
+  def put(self, data, ext='png'):
+    img_hash = hashlib.md5(data).hexdigest()
+    name = f'{img_hash}.{ext}'
+    connection = self.connection()
+    if connection.execute('SELECT 1 FROM images WHERE name = ?', (name,)).fetchone():
+      with self.lock:
+        self.hits += 1
+        self.bytes_saved += len(data)
+      return f'images/{name}'
+    with connection:
+      connection.execute('INSERT INTO images (name, mtime, data) VALUES (?, ?, ?)', (name, time.time(), data))
+    with self.lock:
+      self.writes += 1
+      self.bytes_written += len(data)
+    return f'images/{name}'
+
+  def add(self, images):
+    ## store (name, mtime, data) rows as they are, in one transaction. for packing notebooks
+    with self.connection() as connection:
+      connection.executemany('INSERT INTO images (name, mtime, data) VALUES (?, ?, ?)', images)
+
+  def items(self):
+    ## (name, mtime, data) of everything stored, one image in memory at a time
+    for name, in self.connection().execute('SELECT name FROM images').fetchall():
+      row = self.connection().execute('SELECT mtime, data FROM images WHERE name = ?', (name,)).fetchone()
+      yield name, row[0], row[1]
+
+  def get(self, name):
+    row = self.connection().execute('SELECT data FROM images WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else None
+
+  def file(self, name):
+    ## other programs need a real file, so the image is copied out to a temp directory
+    with self.lock:
+      if not self.extract_path:
+        self.extract_path = tempfile.mkdtemp(prefix='rtnb-images-')
+    target = os.path.join(self.extract_path, name)
+    if not os.path.exists(target):
+      data = self.get(name)
+      if data is None:
+        return target
+      with open(target, 'wb') as fp:
+        fp.write(data)
+    return target
+
+  def names(self):
+    yield from self.connection().execute('SELECT name, length(data), mtime FROM images').fetchall()
+
+  def remove(self, name):
+    with self.connection() as connection:
+      connection.execute('DELETE FROM images WHERE name = ?', (name,))
+
+  def close(self):
+    with self.lock:
+      for connection in self.connections:
+        connection.close()
+      self.connections = []
+      self.local = threading.local()
+      if self.extract_path:
+        shutil.rmtree(self.extract_path, ignore_errors=True)
+        self.extract_path = None
+
+def open_store(path):
+  ## the image store of a notebook, in whichever layout it has
+  if notebook.is_packed(path):
+    return PackedImageStore(path)
+  return ImageStore(os.path.join(path, 'images'))
+
+def image_width(data):
+  ## the width of the image in data, from its header, or 0 if it can't be read
+  from PyQt5.QtCore import QBuffer, QIODevice
+  from PyQt5.QtGui import QImageReader
+  buffer = QBuffer()
+  buffer.setData(data)
+  buffer.open(QIODevice.ReadOnly)
+  size = QImageReader(buffer).size()
+  return size.width() if size.isValid() else 0
+
+def reencode(data, format, quality, max_width=0):
+  ## returns the image in data encoded as format, or None if it can't be read. QtGui is only
+  ## loaded here, as QImage needs no display, so headless tools can call this from a process pool
+  from PyQt5.QtCore import Qt, QBuffer, QByteArray, QIODevice
+  from PyQt5.QtGui import QColor, QImage, QPainter
+  image = QImage.fromData(data)
+  if image.isNull():
+    return None
+  if max_width and image.width() > max_width:
+    image = image.scaledToWidth(max_width, Qt.SmoothTransformation)
+  if format in ('jpg', 'jpeg') and image.hasAlphaChannel():
+    ## jpeg has no alpha channel, so flatten onto white the way the editor shows it
+    flat = QImage(image.size(), QImage.Format_RGB32)
+    flat.fill(QColor('white'))
+    painter = QPainter(flat)
+    painter.drawImage(0, 0, image)
+    painter.end()
+    image = flat
+  encoded = QByteArray()
+  buffer = QBuffer(encoded)
+  buffer.open(QIODevice.WriteOnly)
+  if not image.save(buffer, format.upper(), quality):
+    return None
+  return bytes(encoded)
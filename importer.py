@@ -0,0 +1,147 @@
+## turn scan results into node graph records, without touching the gui
+import uuid
+from sqlalchemy.sql import bindparam
+from xml.etree import ElementTree
+
+import catalog
+
+OS_ICONS = {'Windows': 'os_win.png', 'Linux': 'os_linux.png', 'Mac OS X': 'os_apple.png', 'FreeBSD': 'os_freebsd.png' }
+PORT_ICONS = {'closed': 'stat_red.png', 'filtered': 'stat_yellow.png'}
+
+def parse_host(elem):
+  ## reduce a <host> element to the plain values we build nodes from
+  addresses = {address.get('addrtype'): address.get('addr') for address in elem.iterfind('address')}
+  status = elem.find('status')
+  os = elem.find('os')
+  services = []
+  for port in elem.iterfind('ports/port'):
+    state = port.find('state')
+    services.append((port.get('protocol'), int(port.get('portid')), state.get('state') if state is not None else None))
+  return {
+    'address': addresses.get('ipv4') or addresses.get('ipv6') or '',
+    'up': status is not None and status.get('state') == 'up',
+    'hostnames': [hostname.get('name') for hostname in elem.iterfind('hostnames/hostname')],
+    'osfamilies': [osclass.get('osfamily') for osclass in os.iter('osclass')] if os is not None else [],
+    'services': services,
+  }
+
+def iter_hosts(fp):
+  ## stream the report one <host> at a time, dropping each one once it is parsed
+  context = ElementTree.iterparse(fp, events=('start', 'end'))
+  _, root = next(context)
+  for event, elem in context:
+    if event == 'end' and elem.tag == 'host':
+      yield parse_host(elem)
+      root.clear()
+
+def parse_file(filename):
+  ## read a whole report into plain host values. these pickle cheaply, so this can run in a worker process
+  with open(filename, 'rb') as fp:
+    return list(iter_hosts(fp))
+
+def host_label(host):
+  if host['hostnames']:
+    return f"{host['address']} ({host['hostnames'][0]})"
+  return f"{host['address']}"
+
+def host_icon(host):
+  ## use the first OS family we have an icon for
+  for osfamily in host['osfamilies']:
+    if osfamily in OS_ICONS:
+      return OS_ICONS[osfamily]
+  return 'question.png'
+
+def port_label(protocol, port, state):
+  return f'{port} {protocol} [{state}]'
+
+def port_icon(state):
+  return PORT_ICONS.get(state, 'stat_green.png')
+
+def new_node(parentid, basename, icon=None):
+  return catalog.NodeRecord(uuid.uuid4().hex, parentid, basename, icon)
+
+def host_nodes(host, parentid):
+  ## build the host -> protocol -> port subtree, parents before children
+  host_node = new_node(parentid, host_label(host), host_icon(host))
+  nodes = [host_node]
+  protocols = {}
+  ports = []
+  for protocol, port, state in host['services']:
+    if protocol not in protocols:
+      protocols[protocol] = new_node(host_node.nodeid, protocol)
+      nodes.append(protocols[protocol])
+    ports.append(new_node(protocols[protocol].nodeid, port_label(protocol, port, state), port_icon(state)))
+  nodes.extend(ports)
+  return nodes
+
+class ScanIndex():
+  ## the hosts, protocols and ports already under a node, keyed so a rescan can be merged in
+  def __init__(self, db, parentid):
+    self.hosts = {}
+    self.protocols = {}
+    self.ports = {}
+    ## one pass over the graph is cheaper than walking three levels of it
+    children = catalog.load_adjacency(db)
+    for host in children.get(parentid, []):
+      self.hosts[host.basename.split(' ')[0]] = host.nodeid
+      for proto in children.get(host.nodeid, []):
+        self.protocols[(host.nodeid, proto.basename)] = proto.nodeid
+        for port in children.get(proto.nodeid, []):
+          self.ports[(proto.nodeid, port.basename.split(' ')[0])] = port
+
+def merge_nodes(hosts, parentid, index):
+  ## add what is new to the tree, and collect (old, new) records for ports whose state changed
+  nodes = []
+  updates = []
+  for host in hosts:
+    if not host['up']:
+      continue
+    if host['address'] not in index.hosts:
+      host_node = new_node(parentid, host_label(host), host_icon(host))
+      nodes.append(host_node)
+      index.hosts[host['address']] = host_node.nodeid
+    hostid = index.hosts[host['address']]
+
+    ports = []
+    for protocol, port, state in host['services']:
+      if (hostid, protocol) not in index.protocols:
+        proto_node = new_node(hostid, protocol)
+        nodes.append(proto_node)
+        index.protocols[(hostid, protocol)] = proto_node.nodeid
+      protoid = index.protocols[(hostid, protocol)]
+
+      key = (protoid, str(port))
+      label = port_label(protocol, port, state)
+      icon = port_icon(state)
+      if key not in index.ports:
+        index.ports[key] = new_node(protoid, label, icon)
+        ports.append(index.ports[key])
+      elif (index.ports[key].basename, index.ports[key].icon) != (label, icon):
+        updates.append((index.ports[key], index.ports[key]._replace(basename=label, icon=icon)))
+        index.ports[key] = updates[-1][1]
+    nodes.extend(ports)
+  return nodes, updates
+
+def scan_nodes(hosts, parentid):
+  ## hosts that are down are left out, like the scan report does
+  nodes = []
+  for host in hosts:
+    if host['up']:
+      nodes.extend(host_nodes(host, parentid))
+  return nodes
+
+def write_nodes(db, nodes, updates=()):
+  ## insert and update the whole batch in a single transaction
+  table = catalog.NodeGraph.__table__
+  if nodes:
+    db.execute(table.insert(), [node._asdict() for node in nodes])
+    catalog.index_new_nodes(db)
+  if updates:
+    update = table.update().where(table.c.nodeid == bindparam('_nodeid')).values(basename=bindparam('_basename'), icon=bindparam('_icon'))
+    db.execute(update, [{'_nodeid': node.nodeid, '_basename': node.basename, '_icon': node.icon} for node in updates])
+  db.commit()
+
+def remove_subtrees(db, nodeids):
+  ## undo a partial import. each subtree goes the way a deleted node does, notes and all
+  catalog.delete_subtrees(db, nodeids)
+  db.commit()
@@ -13,3 +13,5 @@ CREATE TABLE notes (
   mtime FLOAT,
   UNIQUE(nodeid) ON CONFLICT REPLACE
 );
+
+CREATE INDEX node_graph_parentid ON node_graph (parentid);
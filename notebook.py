@@ -0,0 +1,478 @@
+## notebook storage, shared by the gui and the headless tools. this must not import PyQt5
+import collections
+import contextlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import sqlalchemy
+import sqlalchemy.event
+import sqlalchemy.orm
+import sqlalchemy.pool
+
+import catalog
+
+## set from --debug
+DEBUG = False
+
+## per connection page cache, in KiB, and how much of the file sqlite may memory map
+CACHE_SIZE = 16384
+MMAP_SIZE = 256 * 1024 * 1024
+POOL_SIZE = 5
+
+## schema changes, applied in order to bring older notebooks up to date.
+## PRAGMA user_version records how many have been applied
+MIGRATIONS = [
+  ## child lookups would otherwise scan the whole graph
+  ['CREATE INDEX IF NOT EXISTS node_graph_parentid ON node_graph (parentid)'],
+  ## large notes are stored as chunks, see catalog.split_chunks
+  ['ALTER TABLE notes ADD COLUMN chunks TEXT',
+   """CREATE TABLE IF NOT EXISTS note_chunks (
+  nodeid TEXT,
+  hash TEXT,
+  content TEXT,
+  PRIMARY KEY(nodeid, hash) ON CONFLICT IGNORE
+)"""],
+  ## full text search over node names and notes
+  catalog.SEARCH_SCHEMA + catalog.SEARCH_REBUILD,
+  ## the note triggers put chunked notes together in order
+  ['DROP TRIGGER IF EXISTS search_note_insert', 'DROP TRIGGER IF EXISTS search_note_update'] + catalog.SEARCH_SCHEMA + catalog.SEARCH_REBUILD,
+]
+
+## a packed notebook is a single file: the catalog, with the images stored in it
+PACK_EXT = '.rtnb'
+
+## one engine, and its connection pool, for each open notebook
+engines = {}
+## and the one thread writing notes for all of them
+note_writer = None
+writer_lock = threading.Lock()
+
+def info(text, level=None):
+  map = {
+    'debug': '[debug] ',
+    'error': '[err] ',
+    'info': '[info] '
+  }
+  prefix=''
+
+  if level == 'debug' and not DEBUG:
+    return
+  if level in map:
+    prefix=map[level]
+  print(prefix+text)
+
+def is_packed(path):
+  return os.path.isfile(path) or path.endswith(PACK_EXT)
+
+def catalog_file(path):
+  return path if is_packed(path) else os.path.join(path, 'catalog.sqlite')
+
+def catalog_url(path):
+  return f'sqlite:///{catalog_file(path)}'
+
+def copy_catalog(source, target):
+  ## the backup api gives a consistent copy, even of a catalog with an open WAL
+  source = sqlite3.connect(source)
+  target = sqlite3.connect(target)
+  with target:
+    source.backup(target)
+  source.close()
+  target.close()
+
+def set_pragmas(connection, record):
+  cursor = connection.cursor()
+  ## WAL lets readers carry on while we write, and only needs to fsync at checkpoints
+  cursor.execute('PRAGMA journal_mode=WAL')
+  cursor.execute('PRAGMA synchronous=NORMAL')
+  cursor.execute(f'PRAGMA cache_size=-{CACHE_SIZE}')
+  cursor.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+  cursor.close()
+
+def get_engine(path):
+  if path not in engines:
+    ## sqlite file engines default to opening a new connection for every session.
+    ## keep a pool instead, and share it with the import threads
+    engine = sqlalchemy.create_engine(catalog_url(path), convert_unicode=True, echo=DEBUG,
+      poolclass=sqlalchemy.pool.QueuePool, pool_size=POOL_SIZE,
+      connect_args={'check_same_thread': False})
+    sqlalchemy.event.listen(engine, 'connect', set_pragmas)
+    engines[path] = engine
+  return engines[path]
+
+def close_engine(path):
+  ## closing the last connection also checkpoints the WAL back into the catalog
+  engine = engines.pop(path, None)
+  if engine:
+    engine.dispose()
+
+def migrate(path):
+  db = get_engine(path).connect()
+  version = db.execute('PRAGMA user_version').scalar()
+  for version, statements in enumerate(MIGRATIONS[version:], version + 1):
+    info (f'Migrating catalog to version {version}...', level='info')
+    with db.begin():
+      for sql in statements:
+        db.execute(sql)
+      db.execute(f'PRAGMA user_version={version}')
+  db.close()
+
+def init_sql(path):
+  info ('Setting up sql...', level='info')
+  ## create our tables
+  db_engine = get_engine(path)
+
+  ## apparently, sqlalchemy does not yet support ON CASCADE REPLACE, so we need to pass
+  ## some raw SQL to create our schema
+
+  db = db_engine.connect()
+
+  sql = """CREATE TABLE IF NOT EXISTS node_graph (
+  nodeid TEXT,
+  parentid TEXT,
+  basename TEXT,
+  icon TEXT,
+  mtime FLOAT,
+  UNIQUE(nodeid)
+);"""
+  db.execute(sql)
+
+  sql = """CREATE TABLE IF NOT EXISTS notes (
+  nodeid TEXT,
+  content TEXT,
+  mtime FLOAT,
+  UNIQUE(nodeid) ON CONFLICT REPLACE,
+  CONSTRAINT fk_nodeid
+    FOREIGN KEY (nodeid)
+    REFERENCES node_graph(nodeid)
+    ON DELETE CASCADE
+);"""
+  db.execute(sql)
+  db.close()
+
+def create_session(path):
+  return sqlalchemy.orm.sessionmaker(bind=get_engine(path))
+
+def init_notebook(path):
+  ## create the notebook if it doesn't exist
+  if is_packed(path):
+    if not os.path.exists(path):
+      init_sql(path)
+    migrate(path)
+    with get_engine(path).begin() as db:
+      db.execute(catalog.IMAGE_SCHEMA)
+    return
+  if not os.path.exists(path):
+    os.mkdir(path)
+    if not os.path.exists(path):
+      info ('Unable to create notebook.', level='error')
+      sys.exit(1)
+  if not os.path.exists(path+'/images'):
+    os.mkdir(path+'/images')
+  if not os.path.exists(path+'/catalog.sqlite'):
+    init_sql(path)
+  migrate(path)
+
+class NoteWriter(threading.Thread):
+  ## commits note saves on its own thread, so the editor never waits on the disk. one writer
+  ## serves every open notebook, with a connection to each, and commits each notebook's
+  ## saves together. a save of a note that is still queued replaces the queued one. done, if
+  ## given, is called on the writer thread with (nodeid, content, error) once the save is
+  ## committed or has failed
+  def __init__(self):
+    super(NoteWriter, self).__init__(daemon=True)
+    ## (path, nodeid): (content, mtime, done)
+    self.pending = collections.OrderedDict()
+    ## chunk hashes of each note as the catalog has it, by (path, nodeid)
+    self.chunks = {}
+    ## notebooks whose connection should be closed once their saves are written
+    self.releases = set()
+    self.condition = threading.Condition()
+    self.busy = False
+    self.stopped = False
+    self.saves = 0
+    self.coalesced = 0
+    self.commits = 0
+    self.commit_time = 0.0
+    self.max_commit_time = 0.0
+
+  def loaded(self, path, nodeid, hashes):
+    with self.condition:
+      self.chunks[(path, nodeid)] = hashes
+
+  def save(self, path, nodeid, content, mtime, done=None):
+    with self.condition:
+      self.saves += 1
+      if (path, nodeid) in self.pending:
+        self.coalesced += 1
+      self.pending[(path, nodeid)] = (content, mtime, done)
+      self.condition.notify_all()
+
+  def queued(self, path=None):
+    return any(path is None or key[0] == path for key in self.pending)
+
+  def flush(self, path=None):
+    ## wait until everything queued so far for the notebook, or for all of them, is committed
+    with self.condition:
+      while (self.queued(path) or self.busy) and self.is_alive():
+        self.condition.wait()
+
+  def release(self, path):
+    ## write out the notebook's saves, then close the connection to it
+    with self.condition:
+      self.releases.add(path)
+      self.condition.notify_all()
+      while path in self.releases and self.is_alive():
+        self.condition.wait()
+      for key in [key for key in self.chunks if key[0] == path]:
+        del self.chunks[key]
+
+  def stop(self):
+    with self.condition:
+      self.stopped = True
+      self.condition.notify_all()
+    self.join()
+
+  def run(self):
+    connections = {}
+    try:
+      while True:
+        with self.condition:
+          while not self.pending and not self.releases and not self.stopped:
+            self.condition.wait()
+          if not self.pending and not self.releases:
+            return
+          jobs = self.pending
+          self.pending = collections.OrderedDict()
+          releases = set(self.releases)
+          self.busy = True
+        try:
+          notebooks = collections.OrderedDict()
+          for (path, nodeid), job in jobs.items():
+            notebooks.setdefault(path, {})[nodeid] = job
+          for path, notes in notebooks.items():
+            error = None
+            try:
+              if path not in connections:
+                connection = get_engine(path).connect()
+                connections[path] = (connection, sqlalchemy.orm.Session(bind=connection))
+              db = connections[path][1]
+              try:
+                self.write(db, path, notes)
+              except:
+                db.rollback()
+                raise
+            except Exception as e:
+              error = e
+              info (f'Unable to save notes: {e}', level='error')
+            for nodeid, (content, mtime, done) in notes.items():
+              if done:
+                done(nodeid, content, error)
+          for path in releases:
+            if path in connections:
+              connection, db = connections.pop(path)
+              db.close()
+              connection.close()
+        finally:
+          with self.condition:
+            self.busy = False
+            self.releases -= releases
+            self.condition.notify_all()
+    finally:
+      for connection, db in connections.values():
+        db.close()
+        connection.close()
+
+  def write(self, db, path, jobs):
+    start = time.perf_counter()
+    written = {}
+    for nodeid, (content, mtime, done) in jobs.items():
+      chunks = catalog.split_chunks(content)
+      write_note(db, nodeid, content, mtime, chunks, self.chunks.get((path, nodeid)))
+      written[(path, nodeid)] = [h for h, chunk in chunks] if chunks else None
+    db.commit()
+    with self.condition:
+      self.chunks.update(written)
+
+    elapsed = time.perf_counter() - start
+    self.commits += 1
+    self.commit_time += elapsed
+    self.max_commit_time = max(self.max_commit_time, elapsed)
+    info (f'Notes: {self.stats()}', level='debug')
+
+  def stats(self):
+    average = self.commit_time / self.commits if self.commits else 0.0
+    return f'{self.saves} saves ({self.coalesced} coalesced) in {self.commits} commits, {average * 1000:.1f} ms avg, {self.max_commit_time * 1000:.1f} ms max commit'
+
+def shared_writer():
+  ## the note writer, started on first use
+  global note_writer
+  with writer_lock:
+    if not note_writer or not note_writer.is_alive():
+      note_writer = NoteWriter()
+      note_writer.start()
+  return note_writer
+
+def stop_writer():
+  ## write out every queued note and end the writer thread. the next save starts a new one
+  global note_writer
+  with writer_lock:
+    writer, note_writer = note_writer, None
+  if writer:
+    writer.stop()
+
+def write_note(db, nodeid, content, mtime, chunks, old_hashes):
+  if not chunks:
+    db.add(catalog.Note(nodeid=nodeid, content=content, mtime=mtime))
+    if old_hashes:
+      db.query(catalog.NoteChunk).filter_by(nodeid=nodeid).delete(synchronize_session=False)
+    return
+  ## only the chunks that are new get written, and only the ones no longer used are removed
+  hashes = [h for h, chunk in chunks]
+  old_hashes = set(old_hashes or [])
+  new_chunks = {h: chunk for h, chunk in chunks if h not in old_hashes}
+  if new_chunks:
+    db.execute(catalog.NoteChunk.__table__.insert(), [{'nodeid': nodeid, 'hash': h, 'content': chunk} for h, chunk in new_chunks.items()])
+  removed = list(old_hashes - set(hashes))
+  for i in range(0, len(removed), 500):
+    db.query(catalog.NoteChunk).filter(catalog.NoteChunk.nodeid == nodeid, catalog.NoteChunk.hash.in_(removed[i:i+500])).delete(synchronize_session=False)
+  db.add(catalog.Note(nodeid=nodeid, content=None, mtime=mtime, chunks=' '.join(hashes)))
+
+class Repository():
+  ## queues the small catalog writes the notebook makes as it is edited, and commits them
+  ## together. call flush() at boundaries; schedule, if set, is called when a write is queued.
+  ## notes are handed to the shared NoteWriter, and notes it could not write are handed to it
+  ## again on the next flush
+  def __init__(self, path, schedule=None):
+    self.path = path
+    self.Session = create_session(path)
+    self.schedule = schedule
+    self.new_nodes = collections.OrderedDict()
+    self.updates = collections.OrderedDict()
+    self.writer = shared_writer()
+    ## content hash of each note as the catalog has it, and of the last save handed to the writer
+    self.saved = {}
+    self.submitted = {}
+    ## content of notes whose last save failed, by nodeid
+    self.failed = {}
+    self.lock = threading.Lock()
+    self.writes = 0
+    self.skipped = 0
+    self.commits = 0
+    self.commit_time = 0.0
+    self.max_commit_time = 0.0
+
+  def __len__(self):
+    return len(self.new_nodes) + len(self.updates)
+
+  @contextlib.contextmanager
+  def session(self):
+    ## reads see everything queued so far, and the session is always released
+    self.flush()
+    db = self.Session()
+    try:
+      yield db
+    finally:
+      db.close()
+
+  def queued(self):
+    self.writes += 1
+    if self.schedule:
+      self.schedule()
+
+  def add_node(self, nodeid, parentid, basename, icon=None):
+    self.new_nodes[nodeid] = {'nodeid': nodeid, 'parentid': parentid, 'basename': basename, 'icon': icon}
+    self.queued()
+
+  def update_node(self, nodeid, **values):
+    ## later changes to the same node are folded into one write
+    if nodeid in self.new_nodes:
+      self.new_nodes[nodeid].update(values)
+    else:
+      self.updates.setdefault(nodeid, {}).update(values)
+    self.queued()
+
+  def load_note(self, nodeid):
+    with self.session() as db:
+      content, hashes = catalog.load_note(db, nodeid)
+    with self.lock:
+      self.saved[nodeid] = catalog.content_hash(content or '')
+      ## an edit that has not made it to the catalog yet is newer than what is there
+      content = self.failed.get(nodeid, content)
+    self.writer.loaded(self.path, nodeid, hashes)
+    return content
+
+  def save_note(self, nodeid, content):
+    ## unchanged notes are not written at all
+    content_hash = catalog.content_hash(content)
+    with self.lock:
+      if content_hash == self.submitted.get(nodeid, self.saved.get(nodeid)):
+        self.skipped += 1
+        return
+      self.submitted[nodeid] = content_hash
+      self.failed.pop(nodeid, None)
+    self.writes += 1
+    self.writer.save(self.path, nodeid, content, time.time(), self.note_written)
+
+  def note_written(self, nodeid, content, error):
+    ## called by the writer. the note only counts as saved once it is committed
+    content_hash = catalog.content_hash(content)
+    with self.lock:
+      latest = self.submitted.get(nodeid) == content_hash
+      if error:
+        ## keep it for the next flush, unless a newer save has been queued since
+        if latest:
+          self.failed[nodeid] = content
+        return
+      self.saved[nodeid] = content_hash
+      if latest:
+        del self.submitted[nodeid]
+        self.failed.pop(nodeid, None)
+
+  def delete_subtree(self, nodeid):
+    ## deletes are written straight away, in the same transaction as what is queued,
+    ## so nodes added under the subtree go with it
+    self.writes += 1
+    self.flush(subtree=nodeid)
+
+  def close(self):
+    self.flush()
+    self.writer.release(self.path)
+
+  def flush(self, subtree=None):
+    with self.lock:
+      retries = list(self.failed.items())
+    for nodeid, content in retries:
+      self.writer.save(self.path, nodeid, content, time.time(), self.note_written)
+    self.writer.flush(self.path)
+    if not len(self) and not subtree:
+      return
+    start = time.perf_counter()
+    db = self.Session()
+    try:
+      for values in self.new_nodes.values():
+        db.add(catalog.NodeGraph(**values))
+      if self.new_nodes:
+        db.flush()
+        catalog.index_new_nodes(db)
+      for nodeid, values in self.updates.items():
+        db.query(catalog.NodeGraph).filter_by(nodeid=nodeid).update(values, synchronize_session=False)
+      if subtree:
+        catalog.delete_subtree(db, subtree)
+      db.commit()
+    finally:
+      db.close()
+    self.new_nodes.clear()
+    self.updates.clear()
+
+    elapsed = time.perf_counter() - start
+    self.commits += 1
+    self.commit_time += elapsed
+    self.max_commit_time = max(self.max_commit_time, elapsed)
+    info (f'Catalog: {self.stats()}', level='debug')
+
+  def stats(self):
+    average = self.commit_time / self.commits if self.commits else 0.0
+    return f'{self.writes} writes in {self.commits} commits, {average * 1000:.1f} ms avg, {self.max_commit_time * 1000:.1f} ms max commit, {self.skipped} unchanged notes skipped; notes: {self.writer.stats()}'
@@ -6,19 +6,26 @@ from PyQt5.QtCore import *
 from PyQt5.QtPrintSupport import *
 
 import argparse
+import collections
+import concurrent.futures
+import multiprocessing
 import platform
-import sqlalchemy
 import subprocess
+import threading
 import catalog
+import imagestore
+import importer
+import notebook
 
-from libnmap.parser import NmapParser
 import hashlib
 import json
 import os
-import shutil
 import sys
+import time
 import uuid
 
+from notebook import info
+
 from math import ceil
 
 APP_PATH = os.path.dirname(os.path.realpath(__file__))+'/'
@@ -30,17 +37,50 @@ IMAGE_EXTENSIONS = ['.jpg','.jpeg','.png','.bmp']
 HTML_EXTENSIONS = ['.htm', '.html']
 NODE_ICON_PATH = os.path.abspath(APP_PATH+'/images/nodes')
 ROLE_NODE_UUID = Qt.UserRole + 1
+ROLE_NODE_ICON = Qt.UserRole + 2
 NOTEBOOK_PATH = os.path.abspath(os.path.expanduser('~/default.notebook'))
 SETTINGS = os.path.abspath(os.path.expanduser('~/.local/redteamnotebook.cfg'))
-OS_ICONS = {'Windows': 'os_win.png', 'Linux': 'os_linux.png', 'Mac OS X': 'os_apple.png', 'FreeBSD': 'os_freebsd.png' }
+DOC_CACHE_SIZE = 100
+## memory for scaled note images, in bytes, and whether to keep them on disk too
+IMAGE_CACHE_SIZE = 64 * 1024 * 1024
+IMAGE_DISK_CACHE = False
+IMPORT_BATCH = 250
+IMPORT_JOBS = os.cpu_count() or 1
+## most report parsing processes, and image threads, one notebook may use at once. the
+## processes and threads are shared by every open notebook
+IMPORT_JOBS_PER_NOTEBOOK = IMPORT_JOBS
+IMAGE_JOBS_PER_NOTEBOOK = max(1, (os.cpu_count() or 1) // 2)
+LAZY_TREE = False
+## most filter matches a lazily loaded tree fetches the branches of
+LAZY_FILTER_LIMIT = 1000
+## recently used notebooks kept open, so switching back to one doesn't reload it, and the
+## memory they may hold between them, in bytes
+NOTEBOOK_CACHE_SIZE = 4
+NOTEBOOK_CACHE_MEMORY = 512 * 1024 * 1024
+## rough sizes of a tree item, and of a character of a parsed note, for those estimates
+TREE_ITEM_BYTES = 1536
+DOC_CHAR_BYTES = 6
 
 ##
 settings = {
 'last_open_notebook': NOTEBOOK_PATH
 }
 
-## initialize Session for the db
-Session = None
+## every open window, and the notebooks open in the background, shared between them
+windows = []
+Notebooks = None
+## the report parsing processes every import shares, started on first use
+import_pool = None
+import_pool_lock = threading.Lock()
+
+## how long edits are collected before they are committed, in ms
+WRITE_DELAY = 500
+## notes are saved after a pause in typing, but never held back longer than the max, in ms
+SAVE_DELAY = 1000
+SAVE_MAX_DELAY = 5000
+## how long to wait for typing to stop before searching or filtering the tree, in ms
+SEARCH_DELAY = 200
+FILTER_DELAY = 150
 
 
 def hexuuid():
@@ -49,35 +89,306 @@ def hexuuid():
 def splitext(p):
   return os.path.splitext(p)[1].lower()
 
-def info(text, level=None):
-  global args
-
-  map = {
-    'debug': '[debug] ',
-    'error': '[err] ',
-    'info': '[info] '
-  }
-  prefix=''
-
-  if level == 'debug' and not args.debug:
-    return
-  if level in map:
-    prefix=map[level]
-  print(prefix+text)
-
-def move_node(uuid=None, parentid=None):
-  db = Session()
-  node = db.query(catalog.NodeGraph).get(uuid)
-  ## update the icon in the catalog
-  if node:
-    node.parentid = parentid
-    db.add(node)
-    db.commit()
-  else:
-    info ('Unable to find node in catalog.', level='error')
+def move_node(repo, uuid=None, parentid=None):
+  repo.update_node(uuid, parentid=parentid)
+
+class DocumentCache():
+  ## busy, if given, says whether a doc must stay in the cache for now
+  def __init__(self, size, load, flush, busy=None):
+    ## leave room for the note on screen and the one being opened
+    self.size = max(2, size)
+    self.load = load
+    self.flush = flush
+    self.busy = busy
+    self.hits = 0
+    self.misses = 0
+    self._docs = collections.OrderedDict()
+
+  def __len__(self):
+    return len(self._docs)
+
+  def get(self, uuid):
+    if uuid in self._docs:
+      self.hits += 1
+      self._docs.move_to_end(uuid)
+      return self._docs[uuid]
+
+    ## parse the note on first use, and make room for it
+    self.misses += 1
+    doc = self.load(uuid)
+    self._docs[uuid] = doc
+    ## oldest first, skipping docs that are busy
+    for old in list(self._docs):
+      if len(self._docs) <= self.size:
+        break
+      if old != uuid and not (self.busy and self.busy(self._docs[old])):
+        self.evict(old, self._docs.pop(old))
+    return doc
+
+  def peek(self, uuid):
+    ## the cached doc, without loading it or counting a hit
+    return self._docs.get(uuid)
+
+  def evict(self, uuid, doc):
+    ## never drop unsaved changes
+    if doc.isModified():
+      self.flush(uuid, doc)
+
+  def discard(self, uuid):
+    self._docs.pop(uuid, None)
+
+  def uuids(self):
+    return list(self._docs)
+
+  def documents(self):
+    return list(self._docs.values())
+
+  def clear(self):
+    while self._docs:
+      self.evict(*self._docs.popitem(last=False))
+
+  def save_all(self):
+    ## save unsaved changes, but keep the docs
+    for nodeid, doc in self._docs.items():
+      self.evict(nodeid, doc)
+
+  def stats(self):
+    return f'{len(self._docs)}/{self.size} docs, {self.hits} hits, {self.misses} misses'
+
+class JobQueue():
+  ## runs one notebook's jobs on a thread pool every notebook shares, at most limit at a
+  ## time, so a large drop into one notebook can't hold up the others
+  def __init__(self, pool, limit):
+    self.pool = pool
+    self.limit = max(1, limit)
+    self.running = 0
+    self.queued = collections.deque()
+    self.condition = threading.Condition()
+
+  def start(self, job):
+    with self.condition:
+      if self.running >= self.limit:
+        self.queued.append(job)
+        return
+      self.running += 1
+    self.pool.start(QueuedJob(job, self.done))
+
+  def done(self):
+    ## called on the pool thread as a job ends, which then starts the next one waiting
+    with self.condition:
+      job = self.queued.popleft() if self.queued else None
+      if not job:
+        self.running -= 1
+      self.condition.notify_all()
+    if job:
+      self.pool.start(QueuedJob(job, self.done))
+
+  def wait(self):
+    with self.condition:
+      while self.running or self.queued:
+        self.condition.wait()
+
+class QueuedJob(QRunnable):
+  def __init__(self, job, done):
+    super(QueuedJob, self).__init__()
+    self.job = job
+    self.done = done
+
+  def run(self):
+    try:
+      self.job.run()
+    finally:
+      self.done()
+
+class NotebookState():
+  ## an open notebook: its storage, and what a window shows of it. several can be open at
+  ## once, each in its own window, and recently used ones stay open in the background
+  def __init__(self, path):
+    ## the notebook has to exist before the repository's writer connects to it
+    notebook.init_notebook(path)
+    self.path = path
+    self.session = notebook.create_session(path)
+    self.repo = notebook.Repository(path)
+    self.images = imagestore.open_store(path)
+    self.image_jobs = JobQueue(QThreadPool.globalInstance(), IMAGE_JOBS_PER_NOTEBOOK)
+    ## set up by the window showing it
+    self.window = None
+    self.tree_model = None
+    self.uuid_index = {}
+    self.docs = None
+    self.image_cache = None
+
+  def memory(self):
+    ## an estimate, in bytes. sqlite's page cache is counted as full for every connection
+    engine = notebook.engines.get(self.path)
+    connections = (engine.pool.checkedin() + engine.pool.checkedout() if engine else 0) + 1
+    chars = sum(doc.characterCount() for doc in self.docs.documents()) if self.docs else 0
+    used = self.image_cache.used if self.image_cache else 0
+    return len(self.uuid_index) * TREE_ITEM_BYTES + chars * DOC_CHAR_BYTES + used + connections * notebook.CACHE_SIZE * 1024
+
+  def close(self):
+    self.image_jobs.wait()
+    self.repo.close()
+    self.images.close()
+    notebook.close_engine(self.path)
+
+class NotebookCache():
+  ## the most recently used notebooks that aren't in front, by path. the oldest are closed
+  ## once there are too many, or they hold too much memory
+  def __init__(self, size, memory):
+    self.size = size
+    self.max_memory = memory
+    self.hits = 0
+    self.misses = 0
+    self._notebooks = collections.OrderedDict()
+
+  def __len__(self):
+    return len(self._notebooks)
+
+  def take(self, path):
+    state = self._notebooks.pop(path, None)
+    if state:
+      self.hits += 1
+    else:
+      self.misses += 1
+    return state
+
+  def put(self, state):
+    self._notebooks[state.path] = state
+    while self._notebooks and (len(self._notebooks) > self.size or self.memory() > self.max_memory):
+      path, old = self._notebooks.popitem(last=False)
+      info (f'Closing notebook "{path}"', level='debug')
+      old.close()
+
+  def memory(self):
+    return sum(state.memory() for state in self._notebooks.values())
+
+  def clear(self):
+    while self._notebooks:
+      self._notebooks.popitem(last=False)[1].close()
+
+  def stats(self):
+    return f'{len(self._notebooks)}/{self.size} notebooks, {self.memory() // (1024 * 1024)}/{self.max_memory // (1024 * 1024)} MiB, {self.hits} hits, {self.misses} misses'
+
+class ImageCache():
+  ## resolves the image names notes use against the notebook, and caches image sizes, read
+  ## from the file header without decoding, and images scaled to the width the editor shows
+  ## them at. images are named by their hash, so entries never go stale. scaled images can
+  ## also be kept in a directory, to skip the decode on the next run
+  def __init__(self, size, root, store, disk_path=None):
+    self.size = size
+    self.root = root
+    self.store = store
+    self.disk_path = disk_path
+    self.sizes = {}
+    self.hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+    self.used = 0
+    self._images = collections.OrderedDict()
+
+  def resolve(self, name):
+    ## notes refer to their images relative to the notebook
+    if name.startswith('file:'):
+      return QUrl(name).toLocalFile()
+    if name.startswith('images/'):
+      return self.store.file(name[len('images/'):])
+    return os.path.join(self.root, name)
+
+  def key(self, name):
+    ## names that aren't content hashes need their mtime to stay correct
+    if name.startswith('images/'):
+      return os.path.join(self.root, name)
+    path = self.resolve(name)
+    return f'{path}@{os.path.getmtime(path) if os.path.exists(path) else 0}'
+
+  def reader(self, name):
+    ## packed notebooks hand out the image bytes, rather than a file to read them from
+    if name.startswith('images/') and self.store.packed:
+      buffer = QBuffer()
+      buffer.setData(self.store.get(name[len('images/'):]) or b'')
+      buffer.open(QIODevice.ReadOnly)
+      reader = QImageReader(buffer)
+      reader.buffer = buffer
+      return reader
+    return QImageReader(self.resolve(name))
+
+  def image_size(self, name):
+    key = self.key(name)
+    if key not in self.sizes:
+      self.sizes[key] = self.reader(name).size()
+    return self.sizes[key]
+
+  def scaled(self, name, width):
+    key = (self.key(name), width)
+    if key in self._images:
+      self.hits += 1
+      self._images.move_to_end(key)
+      return self._images[key]
+
+    disk_file = None
+    if self.disk_path:
+      disk_file = os.path.join(self.disk_path, hashlib.md5(key[0].encode('utf-8')).hexdigest() + f'-{width}.png')
+    image = QImage()
+    if disk_file and image.load(disk_file):
+      self.disk_hits += 1
+    else:
+      self.misses += 1
+      reader = self.reader(name)
+      size = reader.size()
+      ## let the decoder do the scaling, it is cheaper than decoding at full size
+      if size.isValid() and size.width() > width:
+        reader.setScaledSize(QSize(width, max(1, size.height() * width // size.width())))
+      image = reader.read()
+      if disk_file and not image.isNull():
+        os.makedirs(self.disk_path, exist_ok=True)
+        image.save(disk_file + '.tmp', 'PNG')
+        os.replace(disk_file + '.tmp', disk_file)
+
+    self._images[key] = image
+    self.used += image.sizeInBytes()
+    while self.used > self.size and len(self._images) > 1:
+      key, old = self._images.popitem(last=False)
+      self.used -= old.sizeInBytes()
+    return image
+
+  def full_size(self, name):
+    ## the image as stored, for printing. not cached, as only the scaled copies are reused
+    return self.reader(name).read()
+
+  def stats(self):
+    return f'{len(self._images)} images, {self.used // 1024} KiB, {self.hits} hits, {self.disk_hits} disk hits, {self.misses} misses'
+
+class NoteDocument(QTextDocument):
+  ## a note that asks the image cache for its images, instead of loading them from the cwd on
+  ## every layout. images come back scaled to the width the editor will show them at
+  def __init__(self, images, image_width=0, *args, **kwargs):
+    super(NoteDocument, self).__init__(*args, **kwargs)
+    self.images = images
+    self.image_width = image_width
+
+  def loadResource(self, type, url):
+    if type == QTextDocument.ImageResource:
+      name = url.toString()
+      size = self.images.image_size(name)
+      if size.isValid():
+        width = min(size.width(), self.image_width) if self.image_width > 0 else size.width()
+        image = self.images.scaled(name, width)
+        ## register it, so the document doesn't ask again
+        self.addResource(type, url, image)
+        return image
+    return super(NoteDocument, self).loadResource(type, url)
+
+node_icons = {}
+
+def node_icon(icon):
+  ## share one QIcon per file, instead of loading it again for every item
+  if icon not in node_icons:
+    node_icons[icon] = QIcon(os.path.join(NODE_ICON_PATH, icon))
+  return node_icons[icon]
 
 class StandardItem(QStandardItem):
-  def __init__(self, txt='', font_size=14, fullref=None, uuid=None, set_bold=False, color=QColor(0, 0, 0)):
+  def __init__(self, txt='', font_size=14, fullref=None, uuid=None, set_bold=False, color=QColor(0, 0, 0), icon=None):
     super().__init__()
 
     fnt = QFont('Helvetica', font_size)
@@ -88,7 +399,8 @@ class StandardItem(QStandardItem):
     self.setFont(fnt)
     self.setText(txt)
     self.setToolTip(txt)
-    self.setIcon(QIcon(os.path.join(NODE_ICON_PATH, 'folder.png')))
+    self.setIcon(node_icon(icon or 'folder.png'))
+    self.setData(icon or 'folder.png', ROLE_NODE_ICON)
     self.setEditable(True)
     self.setData(fullref, Qt.UserRole)
 
@@ -96,6 +408,104 @@ class StandardItem(QStandardItem):
       uuid = hexuuid()
     self.setData(uuid, ROLE_NODE_UUID)
 
+def encode_png(image):
+  buffer = QBuffer()
+  buffer.open(QIODevice.WriteOnly)
+  image.save(buffer, 'PNG')
+  return bytes(buffer.data())
+
+def placeholder_image(size, max_width):
+  ## a grey box the size the image will be shown at, while it is stored
+  width = max(1, min(size.width(), max_width)) if size.isValid() else 200
+  height = max(1, size.height() * width // size.width()) if size.isValid() else 150
+  image = QImage(width, height, QImage.Format_RGB32)
+  image.fill(QColor(230, 230, 230))
+  return image
+
+def node_item(node, parent_fullref=None):
+  ## build the tree item for a catalog node
+  if parent_fullref is None:
+    fullref = '/'+node.basename
+  else:
+    fullref = f'{parent_fullref}/Node'
+  return StandardItem(node.basename, 14, fullref=fullref, uuid=node.nodeid, icon=node.icon)
+
+class TreeFilterModel(QSortFilterProxyModel):
+  ## sits between the tree model and the view. matching is done by Qt, and recursive
+  ## filtering keeps the ancestors of every match visible
+  def __init__(self, *args, **kwargs):
+    super(TreeFilterModel, self).__init__(*args, **kwargs)
+    self.setRecursiveFilteringEnabled(True)
+
+  def set_filter(self, text):
+    role, pattern = filter_pattern(text)
+    ## each of these refilters the tree, so only change the role when we have to
+    if self.filterRole() != role:
+      self.setFilterRole(role)
+    self.setFilterRegularExpression(QRegularExpression(pattern, QRegularExpression.CaseInsensitiveOption))
+
+def like_escape(text):
+  return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def filter_pattern(text, like=False):
+  ## "icon:stat_green" matches node icons, "port:22" or "port:22/tcp" port nodes, and anything else node names.
+  ## gives the item role and regular expression for the tree, or the catalog field and LIKE pattern
+  text = text.strip()
+  if text.startswith('icon:'):
+    if like:
+      return 'icon', '%' + like_escape(text[5:].strip()) + '%'
+    return ROLE_NODE_ICON, QRegularExpression.escape(text[5:].strip())
+  if text.startswith('port:'):
+    ## only port labels, "<port> <protocol> [<state>]" (see importer.port_label), and not hosts
+    ## whose address starts with the same number. "port:22/tcp" also matches the protocol
+    port, _, protocol = text[5:].strip().partition('/')
+    if like:
+      protocol = like_escape(protocol.strip()) if protocol.strip() else '%'
+      return 'basename', like_escape(port.strip()) + ' ' + protocol + ' [%'
+    protocol = QRegularExpression.escape(protocol.strip()) if protocol.strip() else '\\w+'
+    return Qt.DisplayRole, '^' + QRegularExpression.escape(port.strip()) + ' ' + protocol + ' \\['
+  if like:
+    return 'basename', '%' + like_escape(text) + '%'
+  return Qt.DisplayRole, QRegularExpression.escape(text)
+
+class LazyTreeModel(QStandardItemModel):
+  def __init__(self, repo, *args, **kwargs):
+    super(LazyTreeModel, self).__init__(*args, **kwargs)
+    self.repo = repo
+    ## uuids of nodes whose children are still only in the catalog
+    self.unfetched = set()
+
+  def load_roots(self):
+    self.unfetched = set()
+    self.fetch_rows(self.invisibleRootItem(), None)
+
+  def fetch_rows(self, parent_item, parentid):
+    with self.repo.session() as db:
+      rows = catalog.load_children(db, parentid)
+
+    items = []
+    for node, has_children in rows:
+      items.append(node_item(node, parent_item.data(Qt.UserRole)))
+      if has_children:
+        self.unfetched.add(node.nodeid)
+    if items:
+      parent_item.appendRows(items)
+
+  def hasChildren(self, parent=QModelIndex()):
+    if parent.data(ROLE_NODE_UUID) in self.unfetched:
+      return True
+    return super().hasChildren(parent)
+
+  def canFetchMore(self, parent):
+    return parent.data(ROLE_NODE_UUID) in self.unfetched
+
+  def fetchMore(self, parent):
+    uuid = parent.data(ROLE_NODE_UUID)
+    if uuid not in self.unfetched:
+      return
+    self.unfetched.discard(uuid)
+    self.fetch_rows(self.itemFromIndex(parent), uuid)
+
 class CAction(QWidgetAction):
   colorSelected = pyqtSignal(QColor)
 
@@ -132,25 +542,17 @@ class CAction(QWidgetAction):
     ## grab the item
     window = self.parent().parent()
     treeView = window.treeView
-    treeModel = window.treeModel
     idx = treeView.selectedIndexes()
     if not idx: return
-    item = treeModel.itemFromIndex(idx[0])
+    item = window.item_from_index(idx[0])
     uuid = item.data(ROLE_NODE_UUID)
 
     ## change the icon
     item.setIcon(self.sender().icon())
+    item.setData(self.sender().text(), ROLE_NODE_ICON)
 
-    ## fetch the node from the catalog
-    db = Session()
-    node = db.query(catalog.NodeGraph).get(uuid)
     ## update the icon in the catalog
-    if node:
-      node.icon = self.sender().text()
-      db.add(node)
-      db.commit()
-    else:
-      info ('Unable to find node in catalog.', level='error')
+    window.nb.repo.update_node(uuid, icon=self.sender().text())
 
 class CMenu(QMenu):
   def __init__(self, parent):
@@ -163,7 +565,39 @@ class CMenu(QMenu):
   def handleColorSelected(self, color):
     print(color.name())
 
+class ImageJobSignals(QObject):
+  stored = pyqtSignal(str, str)
+  failed = pyqtSignal(str, str)
+
+class ImageJob(QRunnable):
+  ## reads, encodes, hashes and stores one image on the thread pool
+  def __init__(self, store, placeholder, image=None, filename=None):
+    super(ImageJob, self).__init__()
+    self.store = store
+    self.placeholder = placeholder
+    self.image = image
+    self.filename = filename
+    self.signals = ImageJobSignals()
+
+  def run(self):
+    try:
+      image = self.image if self.image is not None else QImage(self.filename)
+      if image.isNull():
+        raise ValueError(f'Unable to read image {self.filename}')
+      self.signals.stored.emit(self.placeholder, self.store.put(encode_png(image)))
+    except Exception as e:
+      self.signals.failed.emit(self.placeholder, str(e))
+
 class TextEdit(QTextEdit):
+  edited = pyqtSignal()
+  ## (notebook, nodeid, document) of a note whose last pending image was stored or dropped
+  images_settled = pyqtSignal(object, str, object)
+
+  def __init__(self, *args, **kwargs):
+    super(TextEdit, self).__init__(*args, **kwargs)
+    ## images still being stored, by placeholder name: (notebook, nodeid, document, job signals)
+    self.pending_images = {}
+
   def canInsertFromMimeData(self, source):
 
     if source.hasImage():
@@ -176,56 +610,115 @@ class TextEdit(QTextEdit):
     cursor = self.textCursor()
     document = self.document()
     max_width = self.size().width()
-    staging_file = 'images/stage.png'
     images = []
 
     if source.hasUrls():
-      ## set image from file
+      ## set image from file. only the size is read here, the pool does the rest
       for u in source.urls():
         file_ext = splitext(str(u.toLocalFile()))
         if u.isLocalFile() and file_ext in IMAGE_EXTENSIONS:
-          images.append(QImage(u.toLocalFile()))
+          images.append((None, u.toLocalFile(), QImageReader(u.toLocalFile()).size()))
     elif source.hasImage():
       ## set image from clipboard content
-      images.append(source.imageData())
+      image = source.imageData()
+      images.append((image, None, image.size()))
 
-    ## save and add our image if we have one
+    ## add placeholders for our images, and store them in the background
     if images:
-      for image in images:
+      for image, filename, size in images:
         ## make sure we insert images on blank lines. Insert one if we need to    
         cursor.movePosition(QTextCursor.StartOfBlock)
         cursor.movePosition(QTextCursor.EndOfBlock, QTextCursor.KeepAnchor)
         if cursor.selectedText().strip():
           cursor.movePosition(QTextCursor.EndOfBlock)
           cursor.insertText("\n")
-        
-        ## save our staging file
-        image.save(os.path.abspath(staging_file))
-        ## get a file hash to rename the staging file
-        img_hash = hashlib.md5(open(staging_file,'rb').read()).hexdigest()
-        ## save the file in the notebook
-        saved_file = f"images/{img_hash}.png"
-        shutil.move(staging_file, saved_file)
-        ## resize img if it's larger than the editor
-        if image.width() > max_width:
-          image = image.scaledToWidth(max_width)
-        ## add image to the doc
-        cursor.insertImage(saved_file)
-        block = cursor.block()
+
+        placeholder = f'pending-image:{hexuuid()}'
+        document.addResource(QTextDocument.ImageResource, QUrl(placeholder), placeholder_image(size, max_width))
+        cursor.insertImage(placeholder)
+
+        job = ImageJob(self.nb.images, placeholder, image=image, filename=filename)
+        job.signals.stored.connect(self.image_stored)
+        job.signals.failed.connect(self.image_failed)
+        self.pending_images[placeholder] = (self.nb, self.nodeid, document, job.signals)
+        self.nb.image_jobs.start(job)
       ## we want to add a newline after our last image if it's the end of the document
       if cursor.blockNumber() == document.blockCount() - 1:
         cursor.insertText("\n")
-      ## make sure we resize our images after inserting
-      self.resizeImages()
       ## when we finish processing our images, just return
       return
 
     ## If we hit a non-image or non-local URL, fall out to the super call & let Qt handle it
     super(TextEdit, self).insertFromMimeData(source)
 
+  def image_stored(self, placeholder, saved_file):
+    nb, nodeid, document, signals = self.pending_images.pop(placeholder, (None, None, None, None))
+    if document is None:
+      return
+    self.settle_image(nb, nodeid, document, placeholder, saved_file)
+    info (f'Images: {self.nb.images.stats()}', level='debug')
+    ## size the real image for the editor
+    if document is self.document():
+      self.resizeImages()
+
+  def image_failed(self, placeholder, error):
+    nb, nodeid, document, signals = self.pending_images.pop(placeholder, (None, None, None, None))
+    if document is not None:
+      self.settle_image(nb, nodeid, document, placeholder, None)
+    info (error, level='error')
+
+  def settle_image(self, nb, nodeid, document, placeholder, saved_file):
+    ## the document may not be on screen any more, so don't let the change mark the one that is
+    ## for saving. the note the image was pasted into is saved once none of its images are pending
+    updating = self.updating
+    self.updating = True
+    self.replace_image(document, placeholder, saved_file)
+    self.updating = updating
+    if not self.has_pending_images(document):
+      self.images_settled.emit(nb, nodeid, document)
+
+  def has_pending_images(self, document):
+    return any(pending[2] is document for pending in self.pending_images.values())
+
+  def replace_image(self, document, name, new_name):
+    ## point every fragment showing an image at another one, or remove it if new_name is None
+    cursor = QTextCursor(document)
+    block = document.begin()
+    while block != document.end():
+      it = block.begin()
+      while not it.atEnd():
+        fragment = it.fragment()
+        it += 1
+        if fragment.isValid() and fragment.charFormat().isImageFormat():
+          img_fmt = fragment.charFormat().toImageFormat()
+          if img_fmt.name() != name:
+            continue
+          cursor.setPosition(fragment.position())
+          cursor.setPosition(fragment.position() + fragment.length(), QTextCursor.KeepAnchor)
+          if new_name is None:
+            cursor.removeSelectedText()
+            continue
+          img_fmt.setName(new_name)
+          img_fmt.setWidth(0)
+          cursor.setCharFormat(img_fmt)
+      block = block.next()
+
+  def finish_images(self):
+    ## wait for images still being stored, so no note is saved pointing at a placeholder
+    if self.pending_images:
+      self.nb.image_jobs.wait()
+      QCoreApplication.processEvents()
+
+  def image_width(self):
+    return self.size().width() - 10
+
   def resizeImages(self):
     document = self.document()
-    max_width = self.size().width() - 10
+    if document is None:
+      return
+    max_width = self.image_width()
+    if isinstance(document, NoteDocument):
+      document.image_width = max_width
     cursor = self.textCursor()
     #cursor.setPosition(0)
 
@@ -237,14 +730,17 @@ class TextEdit(QTextEdit):
         if fragment.isValid():
           if fragment.charFormat().isImageFormat():
             img_fmt = fragment.charFormat().toImageFormat()
-            ## let's figure out our max image size
-            image = QImage()
-            image.load(img_fmt.name())
-            new_width = max_width if image.width() > max_width else image.width()
-            img_fmt.setWidth(new_width)
-            cursor.setPosition(fragment.position())
-            cursor.setPosition(fragment.position() + fragment.length(), QTextCursor.KeepAnchor)
-            cursor.setCharFormat(img_fmt)
+            ## let's figure out our max image size, from the cache
+            width = self.images.image_size(img_fmt.name()).width()
+            new_width = max_width if width > max_width else width
+            ## only touch the format, and the document layout, when the width changes
+            if new_width > 0 and img_fmt.width() != new_width:
+              ## hand the document an image at its display size, so it isn't scaled on every paint
+              document.addResource(QTextDocument.ImageResource, QUrl(img_fmt.name()), self.images.scaled(img_fmt.name(), new_width))
+              img_fmt.setWidth(new_width)
+              cursor.setPosition(fragment.position())
+              cursor.setPosition(fragment.position() + fragment.length(), QTextCursor.KeepAnchor)
+              cursor.setCharFormat(img_fmt)
         it += 1
       block = block.next()
 
@@ -281,7 +777,7 @@ class TextEdit(QTextEdit):
       if fragment.isValid():
         if fragment.charFormat().isImageFormat():
           img_fmt = fragment.charFormat().toImageFormat()
-          self.openfile(img_fmt.name())
+          self.openfile(self.images.resolve(img_fmt.name()))
           break
       it += 1
 
@@ -296,6 +792,7 @@ class TextEdit(QTextEdit):
   def onContentsChanged(self):
     if self.updating: return
     self.save_doc = True
+    self.edited.emit()
     self.updating = True
 
     ## we can do some format checking here later if we want to
@@ -380,33 +877,145 @@ class CTreeView(QTreeView):
       parent = idx.parent()
     elif dip == QAbstractItemView.OnItem:
       parent = idx
-    elif dip == QAbstractItemView.OnViewport:
-      pass
-
-    if not parent:
-      parent = self.treeModel.invisibleRootItem()
+    else:
+      parent = QModelIndex()
 
     uuid = self._node.data(ROLE_NODE_UUID)
     parentid = parent.data(ROLE_NODE_UUID)
 
-    move_node(uuid, parentid)
-    
-    super().dropEvent(event)
+    ## a node can't be moved under itself, or the catalog would hold a cycle
+    ancestor = parent
+    while ancestor.isValid():
+      if ancestor.data(ROLE_NODE_UUID) == uuid:
+        event.ignore()
+        return
+      ancestor = ancestor.parent()
 
+    ## load the target's children first, or they would pick up the moved node again
+    if self.model().canFetchMore(parent):
+      self.model().fetchMore(parent)
+
+    super().dropEvent(event)
+    ## only record moves Qt has made
+    if event.isAccepted():
+      move_node(self.window().nb.repo, uuid, parentid)
+
+class ImportWorker(QObject):
+  batch = pyqtSignal(list, list)
+  progress = pyqtSignal(int)
+  failed = pyqtSignal(str)
+  finished = pyqtSignal()
+
+  def __init__(self, session, filenames, parentid, merge=False):
+    super(ImportWorker, self).__init__()
+    self.session = session
+    self.filenames = filenames
+    self.parentid = parentid
+    self.merge = merge
+    self.cancelled = False
+
+  def run(self):
+    try:
+      ## match rescans against what is already under the parent
+      index = None
+      if self.merge:
+        db = self.session()
+        index = importer.ScanIndex(db, self.parentid)
+        db.close()
+
+      if len(self.filenames) == 1:
+        self.stream_file(self.filenames[0], index)
+      else:
+        self.parse_files(index)
+    except Exception as e:
+      self.failed.emit(str(e))
+    finally:
+      self.finished.emit()
+
+  def stream_file(self, filename, index):
+    size = max(1, os.path.getsize(filename))
+    with open(filename, 'rb') as fp:
+      ## hand finished nodes back to the gui a few hundred hosts at a time
+      hosts = []
+      for host in importer.iter_hosts(fp):
+        if self.cancelled:
+          return
+        hosts.append(host)
+        if len(hosts) == IMPORT_BATCH:
+          self.emit_batch(hosts, index)
+          self.progress.emit(1000 * fp.tell() // size)
+          hosts = []
+      self.emit_batch(hosts, index)
+      self.progress.emit(1000)
+
+  def parse_files(self, index):
+    ## parse every report in a process of the shared pool, and write them out here as they
+    ## complete. only a few are handed to the pool at a time, so imports into other
+    ## notebooks get their turn
+    pool = shared_import_pool()
+    filenames = collections.deque(self.filenames)
+    running = set()
+    count = 0
+    while filenames or running:
+      while filenames and len(running) < IMPORT_JOBS_PER_NOTEBOOK:
+        running.add(pool.submit(importer.parse_file, filenames.popleft()))
+      done, running = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        if self.cancelled:
+          for pending in running:
+            pending.cancel()
+          return
+        hosts = future.result()
+        for i in range(0, len(hosts), IMPORT_BATCH):
+          self.emit_batch(hosts[i:i+IMPORT_BATCH], index)
+        count += 1
+        self.progress.emit(1000 * count // len(self.filenames))
+
+  def emit_batch(self, hosts, index):
+    if index:
+      self.batch.emit(*importer.merge_nodes(hosts, self.parentid, index))
+    else:
+      self.batch.emit(importer.scan_nodes(hosts, self.parentid), [])
+
+def shared_import_pool():
+  ## spawn, since forking a process that runs Qt threads isn't safe
+  global import_pool
+  with import_pool_lock:
+    if not import_pool:
+      import_pool = concurrent.futures.ProcessPoolExecutor(max_workers=IMPORT_JOBS, mp_context=multiprocessing.get_context('spawn'))
+  return import_pool
+
+def shutdown_import_pool():
+  global import_pool
+  with import_pool_lock:
+    if import_pool:
+      import_pool.shutdown()
+      import_pool = None
+
+def shared_notebooks():
+  global Notebooks
+  if not Notebooks:
+    Notebooks = NotebookCache(NOTEBOOK_CACHE_SIZE, NOTEBOOK_CACHE_MEMORY)
+  return Notebooks
 
 class MainWindow(QMainWindow):
-  def __init__(self, *args, **kwargs):
+  def __init__(self, path, *args, **kwargs):
     super(MainWindow, self).__init__(*args, **kwargs)
+    windows.append(self)
+    self.nb = None
 
     layout = QGridLayout()
     layout.setColumnStretch(1,1)
     layout.setSpacing(0)
     layout.setContentsMargins(0,0,0,0)
 
-    self.docs = {}
+    self.docs = None
+    ## map node uuids to their items, so lookups never have to walk the tree
+    self.uuid_index = {}
     self.editor = TextEdit()
     self.editor.updating = False
     self.editor.new_line = False
+    self.editor.nodeid = None
     ## Setup the QTextEdit editor configuration
     self.editor.setAutoFormatting(QTextEdit.AutoAll)
     self.editor.selectionChanged.connect(self.update_format)
@@ -426,23 +1035,29 @@ class MainWindow(QMainWindow):
     self.treeView = CTreeView()
     self.treeView.setStyleSheet("QTreeView { selection-background-color: #c3e3ff;} ")
 
-    self.treeModel = QStandardItemModel()
-    self.treeModel.setHorizontalHeaderLabels(['Targets'])
-    rootNode = self.treeModel.invisibleRootItem()
-
-    ## populate our tree
-    self.load_nodes_from_catalog(clean=True)
-
-    ## use the model with our view
-    self.treeView.setModel(self.treeModel)
+    ## the notebook's tree model is put under the filter once it is open
+    self.treeModel = None
+    self.treeFilter = TreeFilterModel()
+    self.treeView.setModel(self.treeFilter)
     self.treeView.clicked.connect(self.fetch_note)
     self.treeView.setContextMenuPolicy(Qt.CustomContextMenu)
     self.treeView.customContextMenuRequested.connect(self.show_context_menu)
 
+    ## filter box above the tree
+    self.filter_box = QLineEdit()
+    self.filter_box.setPlaceholderText("Filter (name, icon:stat_green, port:22)")
+    self.filter_box.setClearButtonEnabled(True)
+    self.filter_timer = QTimer(self)
+    self.filter_timer.setSingleShot(True)
+    self.filter_timer.setInterval(FILTER_DELAY)
+    self.filter_timer.timeout.connect(self.filter_tree)
+    self.filter_box.textChanged.connect(self.filter_timer.start)
+
+    layout.addWidget(self.filter_box,0,0)
     layout.addWidget(self.treeView,1,0)
-    layout.addWidget(self.editor,1,1)
+    layout.addWidget(self.editor,0,1,2,1)
 
-    self.treeModel.dataChanged.connect(self.tree_changed)
+    self.notebooks = shared_notebooks()
     container = QWidget()
     container.setLayout(layout)
     self.setCentralWidget(container)
@@ -450,6 +1065,43 @@ class MainWindow(QMainWindow):
     self.status = QStatusBar()
     self.setStatusBar(self.status)
 
+    ## progress and cancel for background imports
+    self.import_worker = None
+    self.import_progress = QProgressBar()
+    self.import_progress.setMaximumWidth(200)
+    self.import_progress.hide()
+    self.status.addPermanentWidget(self.import_progress)
+    self.import_cancel = QPushButton("Cancel")
+    self.import_cancel.setStatusTip("Cancel import")
+    self.import_cancel.clicked.connect(self.cancel_import)
+    self.import_cancel.hide()
+    self.status.addPermanentWidget(self.import_cancel)
+
+    ## search dock
+    self.search_box = QLineEdit()
+    self.search_box.setPlaceholderText("Search names and notes")
+    self.search_box.setClearButtonEnabled(True)
+    self.search_results = QListWidget()
+    self.search_results.setWordWrap(True)
+    self.search_results.itemActivated.connect(self.goto_search_result)
+    self.search_results.itemClicked.connect(self.goto_search_result)
+    self.search_timer = QTimer(self)
+    self.search_timer.setSingleShot(True)
+    self.search_timer.setInterval(SEARCH_DELAY)
+    self.search_timer.timeout.connect(self.run_search)
+    self.search_box.textChanged.connect(self.search_timer.start)
+    self.search_box.returnPressed.connect(self.run_search)
+    search_layout = QVBoxLayout()
+    search_layout.setContentsMargins(0, 0, 0, 0)
+    search_layout.addWidget(self.search_box)
+    search_layout.addWidget(self.search_results)
+    search_container = QWidget()
+    search_container.setLayout(search_layout)
+    self.search_dock = QDockWidget("Search", self)
+    self.search_dock.setWidget(search_container)
+    self.addDockWidget(Qt.LeftDockWidgetArea, self.search_dock)
+    self.search_dock.hide()
+
     file_toolbar = QToolBar("File")
     file_toolbar.setIconSize(QSize(14, 14))
     self.addToolBar(file_toolbar)
@@ -461,6 +1113,16 @@ class MainWindow(QMainWindow):
     file_menu.addAction(open_file_action)
     file_toolbar.addAction(open_file_action)
 
+    open_packed_action = QAction("Open packed notebook...", self)
+    open_packed_action.setStatusTip("Open or create a notebook kept in a single file")
+    open_packed_action.triggered.connect(self.file_open_packed)
+    file_menu.addAction(open_packed_action)
+
+    new_window_action = QAction("Open notebook in new window...", self)
+    new_window_action.setStatusTip("Open another notebook alongside this one")
+    new_window_action.triggered.connect(self.file_new_window)
+    file_menu.addAction(new_window_action)
+
     new_root_node_action = QAction(QIcon(os.path.join(APP_PATH+'images', 'add-root-node.png')), "New Root Node", self)
     new_root_node_action.setStatusTip("New Root Node")
     new_root_node_action.triggered.connect(self.add_root_node)
@@ -479,6 +1141,11 @@ class MainWindow(QMainWindow):
     file_menu.addAction(import_nmap_action)
     file_toolbar.addAction(import_nmap_action)
 
+    merge_nmap_action =  QAction(QIcon(os.path.join(APP_PATH+'images', 'zenmap.png')), "Merge NMap rescan", self)
+    merge_nmap_action.setStatusTip("Merge NMap rescan into existing hosts")
+    merge_nmap_action.triggered.connect(lambda: self.import_nmap(merge=True))
+    file_menu.addAction(merge_nmap_action)
+
     print_action = QAction(QIcon(os.path.join(APP_PATH+'images', 'printer.png')), "Print...", self)
     print_action.setStatusTip("Print current page")
     print_action.triggered.connect(self.file_print)
@@ -532,6 +1199,14 @@ class MainWindow(QMainWindow):
 
     edit_menu.addSeparator()
 
+    search_action = QAction("Search...", self)
+    search_action.setStatusTip("Search node names and notes")
+    search_action.setShortcut(QKeySequence.Find)
+    search_action.triggered.connect(self.show_search)
+    edit_menu.addAction(search_action)
+
+    edit_menu.addSeparator()
+
     wrap_action = QAction(QIcon(os.path.join(APP_PATH+'images', 'arrow-continue.png')), "Wrap text to window", self)
     wrap_action.setStatusTip("Toggle wrap text to window")
     wrap_action.setCheckable(True)
@@ -641,13 +1316,43 @@ class MainWindow(QMainWindow):
     self.resize_timer.stop()
     self.resize_timer.timeout.connect(self.editor.resizeImages)
 
-    ## setup our timer to auto save docs
-    timer = QTimer(self)
-    timer.timeout.connect(self.timeout_save)
-    timer.start(5000)
+    ## commit catalog edits shortly after they stop coming in
+    self.write_timer = QTimer(self)
+    self.write_timer.setSingleShot(True)
+    self.write_timer.setInterval(WRITE_DELAY)
+    self.write_timer.timeout.connect(self.flush_writes)
+
+    ## setup our timer to auto save docs, once edits settle
+    self.save_timer = QTimer(self)
+    self.save_timer.setSingleShot(True)
+    self.save_timer.setInterval(SAVE_DELAY)
+    self.save_timer.timeout.connect(self.timeout_save)
+    self.save_started = 0
+    self.editor.edited.connect(self.schedule_save)
+    self.editor.images_settled.connect(self.images_settled)
 
     self.installEventFilter(self)
 
+    ## populate our tree
+    self.show_notebook(self.notebooks.take(path) or NotebookState(path))
+
+  def closeEvent(self, event):
+    ## don't leave a half written import behind
+    if self.import_worker:
+      self.cancel_import()
+      self.import_thread.quit()
+      self.import_thread.wait()
+    ## the notebook stays open in the background while other windows are
+    if self not in windows:
+      return super().closeEvent(event)
+    windows.remove(self)
+    self.notebooks.put(self.hide_notebook())
+    if not windows:
+      self.notebooks.clear()
+      shutdown_import_pool()
+      notebook.stop_writer()
+    super().closeEvent(event)
+
   def resizeEvent(self, event):
     self.resize_timer.stop()
     self.resize_timer.start(250)
@@ -671,41 +1376,69 @@ class MainWindow(QMainWindow):
   def setStyle(self, style):
     self.editor.set_style(style)
 
+  def schedule_save(self):
+    ## keep pushing the save back while typing goes on, up to SAVE_MAX_DELAY
+    if not self.save_timer.isActive():
+      self.save_started = time.monotonic()
+    if (time.monotonic() - self.save_started) * 1000 < SAVE_MAX_DELAY:
+      self.save_timer.start()
+
   def timeout_save(self):
+    self.save_timer.stop()
     if self.editor.save_doc:
-      ## save editor content to catalog
-      db = Session()
-      note = catalog.Note()
-      note.nodeid = self.get_nodeid()
-      note.content = self.editor.toMarkdown()
       ## only save if the nodeid is valid
-      if (not note.nodeid):
-        self.editor.save_doc = False
-        return
-      db.add(note)
-      db.commit()
-      info ("Saved.", level='debug')
+      if self.editor.nodeid:
+        self.save_note(self.editor.nodeid, self.editor.document())
       self.editor.save_doc = False
 
+  def flush_writes(self):
+    self.write_timer.stop()
+    self.nb.repo.flush()
+    ## notes that could not be written are kept by the repository, and tried again next time
+    if self.nb.repo.failed:
+      self.status.showMessage(f'Unable to save {len(self.nb.repo.failed)} note(s), retrying...', 5000)
+      self.write_timer.start()
+
+  def save_note(self, uuid, doc, repo=None):
+    ## a note is saved once its images are stored, so placeholders never reach the catalog
+    if self.editor.has_pending_images(doc):
+      return
+    ## save doc content to catalog
+    (repo or self.nb.repo).save_note(uuid, doc.toMarkdown())
+    doc.setModified(False)
+    info ("Saved.", level='debug')
+
+  def images_settled(self, state, uuid, doc):
+    ## save the note the images were pasted into, even if another one is open now. docs with
+    ## pending images stay cached, so if this one is gone the note was deleted or reloaded since
+    docs = self.docs if state is self.nb else state.docs
+    if not docs or docs.peek(uuid) is not doc:
+      info ('Dropped a save of a note that is no longer open.', level='debug')
+      return
+    if doc.isModified():
+      self.save_note(uuid, doc, state.repo)
+
+  def load_doc(self, uuid):
+    content = self.nb.repo.load_note(uuid)
+
+    ## create a doc on this node and allow it to be saved
+    doc = NoteDocument(self.editor.images, self.editor.image_width())
+    if content:
+      doc.setMarkdown(content)
+    doc.setModified(False)
+    doc.contentsChange.connect(self.editor.onContentsChanged)
+    return doc
+
   def tree_changed(self, signal):
     ## see what changed
-    root = self.treeView.model().invisibleRootItem()
     node = self.treeView.selectedIndexes()
     if not node:
       info ('Unable to find selectedIndexes().', level='error')
       return
     basename = node[0].data(Qt.DisplayRole)
     uuid =  node[0].data(ROLE_NODE_UUID)
-    ## fetch the node from the catalog
-    db = Session()
-    node = db.query(catalog.NodeGraph).get(uuid)
     ## update the basename in the catalog
-    if node:
-      node.basename = basename
-      db.add(node)
-      db.commit()
-    else:
-      info (f'Unable to find node ({uuid}) in catalog.', level='error')
+    self.nb.repo.update_node(uuid, basename=basename)
     return
 
   def show_context_menu(self, position):
@@ -750,10 +1483,11 @@ class MainWindow(QMainWindow):
     desc = ''
 
     if node.data(Qt.DisplayRole) == proto:
-      proto_node = self.treeModel.itemFromIndex(node)
+      proto_node = self.item_from_index(node)
     else:
       ## find our protocol node
-      rootNode = self.treeModel.itemFromIndex(node)
+      rootNode = self.item_from_index(node)
+      self.fetch_children(rootNode)
       for item in self.iterItems(rootNode):
         if item.data(Qt.DisplayRole) == proto:
           proto_node = item
@@ -785,33 +1519,51 @@ class MainWindow(QMainWindow):
     node = self.treeView.selectedIndexes()[0]
     if not node: return None
 
-    db = Session()
-    rootNode = self.treeModel.itemFromIndex(node)
-
-    ## remove children from catalog
-    for item in self.iterItems(rootNode):
-      ## remove node graph
-      db_node = db.query(catalog.NodeGraph).get(item.data(ROLE_NODE_UUID))
-      if db_node:
-        db.delete(db_node)
-      ## remove note
-      db_node = db.query(catalog.Note).get(item.data(ROLE_NODE_UUID)) 
-      if db_node:
-        db.delete(db_node)
-
-
-    ## remove node from catalog
-    db_node = db.query(catalog.NodeGraph).get(rootNode.data(ROLE_NODE_UUID)) 
-    if db_node:
-      db.delete(db_node)
-    db_node = db.query(catalog.Note).get(rootNode.data(ROLE_NODE_UUID)) 
-    if db_node:
-      db.delete(db_node)
-
-    db.commit()
-
-    ## remove node from tree
-    self.treeModel.removeRow(node.row(), parent=node.parent())
+    rootNode = self.item_from_index(node)
+
+    ## drop the cached docs of the subtree, and stop editing if the open note goes away.
+    ## the cache is small, so check each doc rather than walking the subtree
+    for nodeid in self.docs.uuids():
+      if self.in_subtree(self.itemFromUUID(nodeid), rootNode):
+        if nodeid == self.editor.nodeid:
+          self.close_note()
+        self.docs.discard(nodeid)
+
+    ## remove the node and its children from catalog, including any the tree has not loaded
+    self.nb.repo.delete_subtree(rootNode.data(ROLE_NODE_UUID))
+
+    ## remove node from tree, in one go
+    self.treeModel.removeRow(rootNode.row(), rootNode.index().parent())
+
+  def index_rows(self, parent, first, last):
+    parent_item = self.treeModel.itemFromIndex(parent) or self.treeModel.invisibleRootItem()
+    for row in range(first, last + 1):
+      item = parent_item.child(row)
+      self.uuid_index[item.data(ROLE_NODE_UUID)] = item
+      for child in self.iterItems(item):
+        self.uuid_index[child.data(ROLE_NODE_UUID)] = child
+
+  def unindex_rows(self, parent, first, last):
+    parent_item = self.treeModel.itemFromIndex(parent) or self.treeModel.invisibleRootItem()
+    for row in range(first, last + 1):
+      item = parent_item.child(row)
+      for child in [item, *self.iterItems(item)]:
+        uuid = child.data(ROLE_NODE_UUID)
+        ## a moved node is indexed at its new row before the old row goes away
+        if self.uuid_index.get(uuid) is child:
+          del self.uuid_index[uuid]
+
+  def in_subtree(self, item, root):
+    while item is not None:
+      if item is root:
+        return True
+      item = item.parent()
+    return False
+
+  def fetch_children(self, item):
+    ## make sure a lazily loaded branch is in the model before we touch its rows
+    if self.treeModel.canFetchMore(item.index()):
+      self.treeModel.fetchMore(item.index())
 
   def iterItems(self, root):
     def recurse(parent):
@@ -824,29 +1576,157 @@ class MainWindow(QMainWindow):
     if root is not None:
       yield from recurse(root)
 
-  def load_nodes_from_catalog(self, parentid=None, clean=False):
+  def new_tree_model(self):
+    if LAZY_TREE:
+      model = LazyTreeModel(self.nb.repo)
+    else:
+      model = QStandardItemModel()
+    model.setHorizontalHeaderLabels(['Targets'])
+    return model
+
+  def connect_tree_model(self, connect=True):
+    ## every change to the tree goes through these, including drag and drop moves
+    signals = [(self.treeModel.rowsInserted, self.index_rows), (self.treeModel.rowsAboutToBeRemoved, self.unindex_rows), (self.treeModel.dataChanged, self.tree_changed)]
+    for signal, slot in signals:
+      if connect:
+        signal.connect(slot)
+      else:
+        signal.disconnect(slot)
+
+  def load_nodes_from_catalog(self, clean=False):
     ## if clean is set, clear out tree and docs before loading catalog
+    rootNode = self.treeModel.invisibleRootItem()
     if clean:
-      self.docs = {}
-      rootNode = self.treeModel.invisibleRootItem()
+      self.docs.clear()
+      self.uuid_index = {}
       if (rootNode.hasChildren()):
         rootNode.removeRows(0, rootNode.rowCount())
 
-    ## load data from sql
-    db = Session()
-    nodes = db.query(catalog.NodeGraph).filter_by(parentid=parentid).all()
+    ## only the root rows are loaded up front, the rest on expand
+    if LAZY_TREE:
+      self.treeModel.load_roots()
+      return
+
+    ## load the whole graph in one pass
+    with self.nb.repo.session() as db:
+      nodes = catalog.load_tree(db)
+
+    self.append_nodes(nodes)
+    return
+
+  def append_nodes(self, nodes):
+    ## build every item before it is attached to the model. nodes must list parents before children
+    items = {}
+    parents = {}
+    children = {}
     for node in nodes:
-      if not parentid:
-        self.add_root_node(name=node.basename, uuid=node.nodeid, icon=node.icon)
+      if node.parentid in items:
+        parent_item = items[node.parentid]
+      elif node.parentid in parents:
+        parent_item = parents[node.parentid]
       else:
-        self.add_node(name=node.basename, uuid=node.nodeid, parentid=parentid, icon=node.icon)
-      ## add child nodes, recursively
-      self.load_nodes_from_catalog(node.nodeid)
-      ## set content of this node
-      note = db.query(catalog.Note).get(node.nodeid)
-      if note:
-        self.docs[node.nodeid].setMarkdown(note.content)
-    return
+        ## the new rows hang off an existing item, or off the root
+        parent_item = self.itemFromUUID(node.parentid) if node.parentid else self.treeModel.invisibleRootItem()
+        ## branches that aren't loaded yet pick the rows up from the catalog when expanded
+        if not parent_item or self.treeModel.canFetchMore(parent_item.index()):
+          continue
+        parents[node.parentid] = parent_item
+      items[node.nodeid] = node_item(node, parent_item.data(Qt.UserRole))
+      children.setdefault(node.parentid, []).append(items[node.nodeid])
+
+    ## attach children bottom-up, so the model only sees the finished top rows
+    for node in reversed(nodes):
+      if node.nodeid in children:
+        items[node.nodeid].appendRows(children[node.nodeid])
+    ## appendRows doesn't hand the model down to grandchildren, appendRow does
+    for parentid in parents:
+      for item in children[parentid]:
+        parents[parentid].appendRow(item)
+
+  def show_search(self):
+    self.search_dock.show()
+    self.search_box.setFocus()
+    self.search_box.selectAll()
+
+  def run_search(self):
+    self.search_timer.stop()
+    self.search_results.clear()
+    start = time.perf_counter()
+    with self.nb.repo.session() as db:
+      rows = catalog.search(db, self.search_box.text())
+    info (f'Search: {len(rows)} hits in {(time.perf_counter() - start) * 1000:.1f} ms', level='debug')
+    for row in rows:
+      snippet = ' '.join(row.snippet.split())
+      item = QListWidgetItem(f'{row.basename}\n{snippet}' if snippet else row.basename)
+      item.setData(ROLE_NODE_UUID, row.nodeid)
+      self.search_results.addItem(item)
+
+  def goto_search_result(self, result):
+    nodeid = result.data(ROLE_NODE_UUID)
+    ## make sure every branch down to the node is loaded
+    with self.nb.repo.session() as db:
+      path = catalog.ancestors(db, nodeid)
+    for ancestor in path[:-1]:
+      item = self.itemFromUUID(ancestor)
+      if item:
+        self.fetch_children(item)
+    item = self.itemFromUUID(nodeid)
+    if not item:
+      return
+    self.reveal(item)
+    self.treeView.setCurrentIndex(self.view_index(item))
+    self.treeView.scrollTo(self.view_index(item))
+    self.fetch_note(None)
+
+  def filter_tree(self):
+    self.filter_timer.stop()
+    start = time.perf_counter()
+    if self.filter_box.text().strip():
+      self.fetch_filter_matches(self.filter_box.text())
+    self.treeFilter.set_filter(self.filter_box.text())
+    if self.filter_box.text().strip():
+      self.treeView.expandAll()
+    info (f'Filter: {(time.perf_counter() - start) * 1000:.1f} ms', level='debug')
+
+  def fetch_filter_matches(self, text):
+    ## the filter only sees rows in the model, so a lazy tree first fetches every branch that leads to a match
+    if not getattr(self.treeModel, 'unfetched', None):
+      return
+    field, pattern = filter_pattern(text, like=True)
+    with self.nb.repo.session() as db:
+      nodeids, matched = catalog.filter_paths(db, field, pattern, LAZY_FILTER_LIMIT)
+    if matched >= LAZY_FILTER_LIMIT:
+      self.status.showMessage(f'Filter: more than {LAZY_FILTER_LIMIT} matches, some may stay hidden until their branch is expanded.', 5000)
+    ## a branch's rows only exist once its parent is fetched, so keep going while a pass loads anything
+    nodeids = set(nodeids)
+    fetched = True
+    while fetched:
+      fetched = False
+      for nodeid in list(nodeids):
+        item = self.itemFromUUID(nodeid)
+        if item is not None:
+          nodeids.discard(nodeid)
+          if self.treeModel.canFetchMore(item.index()):
+            self.treeModel.fetchMore(item.index())
+            fetched = True
+
+  def reveal(self, item):
+    ## a filter that hides the node would leave nothing to select
+    if not self.view_index(item).isValid():
+      self.filter_box.clear()
+      self.filter_tree()
+
+  def image_cache(self):
+    ## a packed notebook is kept to a single file, so it gets no disk cache
+    disk_path = os.path.join(self.nb.path, 'thumbs') if IMAGE_DISK_CACHE and not self.nb.images.packed else None
+    return ImageCache(IMAGE_CACHE_SIZE, self.nb.path, self.nb.images, disk_path)
+
+  def item_from_index(self, index):
+    ## view indexes belong to the filter, items to the tree model
+    return self.treeModel.itemFromIndex(self.treeFilter.mapToSource(index))
+
+  def view_index(self, item):
+    return self.treeFilter.mapFromSource(item.index())
 
   def get_nodeid(self):
     node = self.treeView.selectedIndexes()
@@ -856,21 +1736,22 @@ class MainWindow(QMainWindow):
     return uuid
     
   def itemFromUUID(self, uuid):
-    rootNode = self.treeModel.invisibleRootItem()
-    for item in self.iterItems(rootNode):
-      if item.data(ROLE_NODE_UUID) == uuid:
-        return item
-    return None
+    return self.uuid_index.get(uuid)
 
   def fetch_note(self, signal):
     uuid = self.get_nodeid()
 
     if not uuid: return
 
+    ## write out the note we are leaving before we switch
+    self.timeout_save()
+
     ## make sure we don't write the text we just loaded
     self.editor.updating = True
     ## display the proper doc
-    self.editor.setDocument(self.docs[uuid])
+    self.editor.setDocument(self.docs.get(uuid))
+    self.editor.nodeid = uuid
+    info (f'Document cache: {self.docs.stats()}', level='debug')
     ## make sure we can edit
     self.editor.setReadOnly(False)
     ## resize images on initial load
@@ -878,6 +1759,12 @@ class MainWindow(QMainWindow):
     ## allow saving changes again
     self.editor.updating = False
 
+  def close_note(self):
+    self.editor.setDocument(None)
+    self.editor.setReadOnly(True)
+    self.editor.nodeid = None
+    self.editor.save_doc = False
+
   def add_root_node(self, name='Node', uuid=None, icon=None):
     record_catalog = False
     if not name:
@@ -888,29 +1775,17 @@ class MainWindow(QMainWindow):
       info ('Recording in catalog...', level='info')
     rootNode = self.treeModel.invisibleRootItem()
     fullref = '/'+name
-    new_node = StandardItem(name, 14, fullref=fullref, uuid=uuid)
-    if icon:
-      new_node.setIcon(QIcon(os.path.join(NODE_ICON_PATH, icon)))
+    new_node = StandardItem(name, 14, fullref=fullref, uuid=uuid, icon=icon)
     rootNode.appendRow(new_node)
     idx = self.itemFromUUID(uuid)
     ## select the new node in the tree
     if idx:
-      self.treeView.setCurrentIndex(idx.index())
-
-    ## create a doc on this node and allow it to be saved
-    self.docs[uuid] = QTextDocument()
-    doc = self.docs[uuid]
-    doc.contentsChange.connect(self.editor.onContentsChanged)
+      self.reveal(idx)
+      self.treeView.setCurrentIndex(self.view_index(idx))
 
     if record_catalog:
       ## record in catalog
-      db = Session()
-      node = catalog.NodeGraph()
-      node.nodeid = uuid
-      node.parentid = None
-      node.basename = name
-      db.add(node)
-      db.commit()
+      self.nb.repo.add_node(uuid, None, name)
 
   def add_node(self, name='Node', uuid=None, parentid=None, icon=None):
     record_catalog = False
@@ -923,43 +1798,28 @@ class MainWindow(QMainWindow):
     ## we will either be given a parent id or check for the selected item in the tree
     idx = None
     if parentid:
-      rootNode = self.treeModel.invisibleRootItem()
-      for item in self.iterItems(rootNode):
-        if item.data(ROLE_NODE_UUID) == parentid:
-          parent_node = item
-          break
+      parent_node = self.itemFromUUID(parentid)
+      if not parent_node: return
     else:
       idx = self.treeView.selectedIndexes()
       if not idx: return
-      parent_node = self.treeModel.itemFromIndex(idx[0])
+      parent_node = self.item_from_index(idx[0])
+    self.fetch_children(parent_node)
 
     parent_fullref = parent_node.data(Qt.UserRole)
     fullref = f'{parent_fullref}/Node'
 
-    new_node = StandardItem(name, 14, fullref=fullref, uuid=uuid)
-    if icon:
-      new_node.setIcon(QIcon(os.path.join(NODE_ICON_PATH, icon)))
+    new_node = StandardItem(name, 14, fullref=fullref, uuid=uuid, icon=icon)
     parent_node.appendRow(new_node)
 
-    ## create a doc on this node and allow it to be saved
-    self.docs[uuid] = QTextDocument()
-    doc = self.docs[uuid]
-    doc.contentsChange.connect(self.editor.onContentsChanged)
-
     if idx:
-      self.treeView.setExpanded(idx[0], True)
+      self.reveal(new_node)
+      self.treeView.setExpanded(self.view_index(parent_node), True)
 
     if record_catalog:
       info ('Recording in catalog...', level='info')
       ## record in catalog
-      db = Session()
-      node = catalog.NodeGraph()
-      node.nodeid = uuid
-      node.parentid = parent_node.data(ROLE_NODE_UUID)
-      node.basename = name
-      node.icon = icon
-      db.add(node)
-      db.commit()
+      self.nb.repo.add_node(uuid, parent_node.data(ROLE_NODE_UUID), name, icon)
 
     return uuid
 
@@ -996,12 +1856,6 @@ class MainWindow(QMainWindow):
     dlg.show()
 
   def file_open(self):
-    global NOTEBOOK_PATH
-
-    ## lock updates
-    self.save_doc = False
-    self.updating = True
-
     dialog = QFileDialog()
     dialog.setFileMode(QFileDialog.DirectoryOnly)
     dialog.exec()
@@ -1009,38 +1863,127 @@ class MainWindow(QMainWindow):
 
     if not path:
       return
+    self.open_notebook(path[0])
 
-    ## don't reopen the same notebook
-    new_path = os.path.abspath(os.path.expanduser(path[0]))
-    if NOTEBOOK_PATH == new_path:
+  def file_open_packed(self):
+    ## a name that doesn't exist yet makes a new packed notebook
+    path = QFileDialog.getSaveFileName(self, 'Open packed notebook', '', f'Packed notebooks (*{notebook.PACK_EXT})', options=QFileDialog.DontConfirmOverwrite)[0]
+    if not path:
       return
+    if not os.path.exists(path) and not path.endswith(notebook.PACK_EXT):
+      path += notebook.PACK_EXT
+    self.open_notebook(path)
 
-    ## we should init the notebook here
-    NOTEBOOK_PATH = new_path
-    info (f'Opening notebook "{NOTEBOOK_PATH}"', level='info')
-
-    ## change the session to match the new file
-    set_session()
+  def open_notebook(self, path):
+    ## don't reopen the same notebook
+    new_path = os.path.abspath(os.path.expanduser(path))
+    if self.nb.path == new_path:
+      return
+    ## a notebook is only shown in one window at a time
+    for window in windows:
+      if window.nb and window.nb.path == new_path:
+        window.raise_()
+        window.activateWindow()
+        return
 
-    ## init the notebook
-    init_notebook()
+    start = time.perf_counter()
+    info (f'Opening notebook "{new_path}"', level='info')
+    state = self.notebooks.take(new_path)
+    ## keep the notebook we are leaving open, so switching back to it is quick
+    self.notebooks.put(self.hide_notebook())
+    self.show_notebook(state or NotebookState(new_path))
+    info (f'Notebook opened in {(time.perf_counter() - start) * 1000:.1f} ms', level='debug')
+    info (f'Notebooks: {self.notebooks.stats()}', level='debug')
+
+  def hide_notebook(self):
+    ## write out any edits, and take the notebook out of the window. the editor ignores
+    ## changes to its docs while the notebook is switched
+    self.editor.updating = True
+    self.cancel_import()
+    self.editor.finish_images()
+    self.timeout_save()
+    self.close_note()
+    self.docs.save_all()
+    self.flush_writes()
+    self.connect_tree_model(False)
+    self.nb.repo.schedule = None
+
+    state = self.nb
+    state.tree_model = self.treeModel
+    state.uuid_index = self.uuid_index
+    state.docs = self.docs
+    state.image_cache = self.editor.images
+    self.nb = None
+    self.editor.updating = False
+    return state
 
-    self.load_nodes_from_catalog(clean=True)
+  def show_notebook(self, state):
+    self.editor.updating = True
+    self.nb = state
+    self.editor.nb = state
+    state.repo.schedule = self.write_timer.start
+    ## parsed notes are tied to the window that loaded them
+    if state.window is not self:
+      state.docs = None
+      state.window = self
+    self.docs = state.docs or DocumentCache(DOC_CACHE_SIZE, self.load_doc, self.save_note, self.editor.has_pending_images)
+    self.editor.images = state.image_cache or self.image_cache()
+    if state.tree_model:
+      self.treeModel = state.tree_model
+      self.uuid_index = state.uuid_index
+      self.connect_tree_model()
+    else:
+      self.treeModel = self.new_tree_model()
+      self.connect_tree_model()
+      self.load_nodes_from_catalog(clean=True)
+    self.treeFilter.setSourceModel(self.treeModel)
+    self.filter_tree()
+    self.search_results.clear()
+    self.path = state.path
     self.update_title()
-    self.editor.setDocument(None)
-    self.editor.setReadOnly(True)
 
     ## update configs
-    settings['last_open_notebook'] = NOTEBOOK_PATH
+    settings['last_open_notebook'] = state.path
     save_settings()
+    self.editor.updating = False
 
-    ## unlock
-    self.updating = False
+  def file_new_window(self):
+    dialog = QFileDialog()
+    dialog.setFileMode(QFileDialog.DirectoryOnly)
+    dialog.exec()
+    path = dialog.selectedFiles()
+    if not path:
+      return
+    path = os.path.abspath(os.path.expanduser(path[0]))
+    for window in windows:
+      if window.nb and window.nb.path == path:
+        window.raise_()
+        window.activateWindow()
+        return
+    MainWindow(path)
 
   def file_print(self):
     dlg = QPrintDialog()
     if dlg.exec_():
-      self.editor.print_(dlg.printer())
+      self.print_document().print_(dlg.printer())
+
+  def print_document(self):
+    ## the editor's doc holds its images scaled to the screen, so print a copy of it holding
+    ## them at full size, laid out at the same width
+    document = self.editor.document().clone()
+    block = document.begin()
+    while block != document.end():
+      it = block.begin()
+      while not it.atEnd():
+        fragment = it.fragment()
+        it += 1
+        if fragment.isValid() and fragment.charFormat().isImageFormat():
+          name = fragment.charFormat().toImageFormat().name()
+          image = self.editor.images.full_size(name)
+          if not image.isNull():
+            document.addResource(QTextDocument.ImageResource, QUrl(name), image)
+      block = block.next()
+    return document
 
   def update_title(self):
     self.setWindowTitle("%s - Redteam Notebook" % (os.path.basename(self.path) if self.path else "Untitled"))
@@ -1048,7 +1991,7 @@ class MainWindow(QMainWindow):
   def edit_toggle_wrap(self):
     self.editor.setLineWrapMode( 1 if self.editor.lineWrapMode() == 0 else 0 )
 
-  def import_nmap(self):
+  def import_nmap(self, merge=False):
     msg = QMessageBox()
     idx = self.treeView.selectedIndexes()
     if not idx:
@@ -1058,142 +2001,156 @@ class MainWindow(QMainWindow):
       msg.exec_()
       return
 
+    if self.import_worker:
+      msg.setIcon(QMessageBox.Warning)
+      msg.setText("Please wait for the current import to finish.")
+      msg.setStandardButtons(QMessageBox.Ok)
+      msg.exec_()
+      return
+
     ## make sure we've selected the first index
     idx = idx[0]
 
     ## grab our id for later
     parentid = idx.data(ROLE_NODE_UUID)
 
-    ## open a dialog to select our file
+    ## open a dialog to select our files
     dialog = QFileDialog()
     filter = 'nmap xml file (*.xml)'
-    filename = dialog.getOpenFileName(None, 'Import NMap XML', '', filter)[0]
+    filenames = dialog.getOpenFileNames(None, 'Import NMap XML', '', filter)[0]
 
     ## If we cancelled the dialog, just return
-    if not filename:
-      return
-
-    ## make sure the filename is valid
-    if not os.path.exists(filename):
-      msg.setIcon(QMessageBox.Critical)
-      msg.setText("Unable to open file!")
-      msg.setStandardButtons(QMessageBox.Ok)
-      msg.exec_()
+    if not filenames:
       return
 
-    ## lock updates
-    self.save_doc = False
-    self.updating = True
+    ## make sure the filenames are valid
+    for filename in filenames:
+      if not os.path.exists(filename):
+        msg.setIcon(QMessageBox.Critical)
+        msg.setText(f"Unable to open file {filename}!")
+        msg.setStandardButtons(QMessageBox.Ok)
+        msg.exec_()
+        return
 
-    ## read xml file
-    nmap_report = NmapParser.parse_fromfile(filename)
+    ## parse in the background, and keep track of what we write so we can undo it
+    self.flush_writes()
+    self.fetch_children(self.itemFromUUID(parentid))
+    self.import_parentid = parentid
+    self.reset_import()
+
+    self.import_thread = QThread(self)
+    self.import_worker = ImportWorker(self.nb.session, filenames, parentid, merge=merge)
+    self.import_worker.moveToThread(self.import_thread)
+    self.import_thread.started.connect(self.import_worker.run)
+    self.import_worker.batch.connect(self.import_batch)
+    self.import_worker.progress.connect(self.import_step)
+    self.import_worker.failed.connect(self.import_failed)
+    self.import_worker.finished.connect(self.import_finished)
+
+    ## progress is tracked through the file, so it works on reports of any size
+    self.import_progress.setRange(0, 1000)
+    self.import_progress.setValue(0)
+    self.import_progress.show()
+    self.import_cancel.show()
+    self.status.showMessage(f'Importing {len(filenames)} file(s)...')
+    self.import_thread.start()
+
+  def reset_import(self):
+    ## new nodes whose parent existed before the import, so a rollback can drop whole subtrees
+    self.import_tops = []
+    self.import_nodeids = set()
+    ## (old, new) records of nodes the import changed
+    self.import_updates = []
+
+  def import_batch(self, nodes, updates):
+    ## ignore anything still in flight after a cancel
+    if not self.import_worker or self.import_worker.cancelled: return
+    for node in nodes:
+      if node.parentid not in self.import_nodeids:
+        self.import_tops.append(node.nodeid)
+      self.import_nodeids.add(node.nodeid)
+    self.import_updates.extend(updates)
+    self.import_nodes(self.import_parentid, nodes, updates)
+
+  def import_step(self, permille):
+    self.import_progress.setValue(permille)
+
+  def import_failed(self, error):
+    info (f'Import failed: {error}', level='error')
+    self.dialog_critical(f'Import failed: {error}')
+    self.import_worker.cancelled = True
+    self.rollback_import()
+
+  def cancel_import(self):
+    if not self.import_worker or self.import_worker.cancelled: return
+    self.import_worker.cancelled = True
+    self.rollback_import()
+    self.status.showMessage('Import cancelled.', 5000)
+
+  def rollback_import(self):
+    ## remove everything this import wrote, and put back what it changed
+    old_nodes = [old for old, new in self.import_updates]
+    ## drop the cached docs of imported nodes and anything added under them
+    for nodeid in self.docs.uuids():
+      item = self.itemFromUUID(nodeid)
+      while item and item.data(ROLE_NODE_UUID) not in self.import_nodeids:
+        item = item.parent()
+      if item:
+        if nodeid == self.editor.nodeid:
+          self.close_note()
+        self.docs.discard(nodeid)
+    ## notes written on imported nodes may still be queued, so write them out to delete them too
+    self.nb.repo.flush()
+    db = self.nb.session()
+    importer.remove_subtrees(db, self.import_tops)
+    importer.write_nodes(db, [], old_nodes)
+    db.close()
+    for nodeid in self.import_tops:
+      item = self.itemFromUUID(nodeid)
+      if item:
+        item.parent().removeRow(item.row())
+    self.update_items(old_nodes)
+    self.reset_import()
+
+  def import_finished(self):
+    if not self.import_worker.cancelled:
+      self.status.showMessage(f'Imported {len(self.import_nodeids)} new and {len(self.import_updates)} changed nodes.', 5000)
+    self.import_thread.quit()
+    self.import_thread.wait()
+    self.import_worker = None
+    self.reset_import()
+    self.import_progress.hide()
+    self.import_cancel.hide()
+
+  def import_nodes(self, parentid, nodes, updates=()):
+    parent_node = self.itemFromUUID(parentid)
+    if not parent_node: return
+    self.fetch_children(parent_node)
+
+    ## one transaction for the whole batch
+    db = self.nb.session()
+    importer.write_nodes(db, nodes, [new for old, new in updates])
+    db.close()
 
     ## load results into tree
-    for host in nmap_report.hosts:
-      if not host.is_up():
-        continue
-      hostid = None
-      icon = 'question.png'
-      ## generate the host label
-      if host.hostnames:
-        label = f'{host.address} ({host.hostnames[0]})'
-      else:
-        label = f'{host.address}'
-
-      ## search for an OS icon
-      for c in host.os_class_probabilities():
-        if c.osfamily in OS_ICONS:
-          icon = OS_ICONS[c.osfamily]
-          break
-
-      ## add our node
-      hostid = self.add_node(name=label, parentid=parentid, icon=icon)
-      if not hostid: continue
-
-      for service in host.services:
-        ## make sure we put services in the correct node
-        ### find our protocol node
-        proto_node = None
-        rootNode = self.itemFromUUID(hostid)
-        for item in self.iterItems(rootNode):
-          if item.data(Qt.DisplayRole) == service.protocol:
-            proto_node = item
-
-        if not proto_node:
-          ### add a node if we couldn't find one
-          uuid = self.add_node(name=service.protocol, parentid=rootNode.data(ROLE_NODE_UUID))
-        else:
-          ### use the node we found
-          uuid = proto_node.data(ROLE_NODE_UUID)
-
-        ## set our node icon
-        if service.state == 'closed':
-          icon = 'stat_red.png'
-        elif service.state == 'filtered':
-          icon = 'stat_yellow.png'
-        else:
-          icon = 'stat_green.png'
-        ## add port to protocol node
-        portid = self.add_node(name=f'{service.port} {service.protocol} [{service.state}]', parentid=uuid, icon=icon)
+    self.append_nodes(nodes)
+    self.update_items([new for old, new in updates])
 
-    self.updating = False
+  def update_items(self, nodes):
+    ## relabel loaded items without every change going back through tree_changed
+    self.treeModel.blockSignals(True)
+    for node in nodes:
+      item = self.itemFromUUID(node.nodeid)
+      if item:
+        item.setText(node.basename)
+        item.setToolTip(node.basename)
+        item.setIcon(node_icon(node.icon or 'folder.png'))
+        item.setData(node.icon or 'folder.png', ROLE_NODE_ICON)
+    self.treeModel.blockSignals(False)
+    self.treeView.viewport().update()
 
 ## END MAIN WINDOW CLASS
 
-def init_sql(sql_path):
-  global args
-  info ('Setting up sql...', level='info')
-  ## create our tables
-  db_engine = sqlalchemy.create_engine(f'sqlite:///{NOTEBOOK_PATH}/catalog.sqlite', convert_unicode=True, echo=args.debug)
-
-  ## apparently, sqlalchemy does not yet support ON CASCADE REPLACE, so we need to pass
-  ## some raw SQL to create our schema
-
-  db = db_engine.connect()
-
-  sql = """CREATE TABLE IF NOT EXISTS node_graph (
-  nodeid TEXT,
-  parentid TEXT,
-  basename TEXT,
-  icon TEXT,
-  mtime FLOAT,
-  UNIQUE(nodeid)
-);"""
-  result = db.execute(sql)
-
-  sql = """CREATE TABLE IF NOT EXISTS notes (
-  nodeid TEXT,
-  content TEXT,
-  mtime FLOAT,
-  UNIQUE(nodeid) ON CONFLICT REPLACE,
-  CONSTRAINT fk_nodeid
-    FOREIGN KEY (nodeid)
-    REFERENCES node_graph(nodeid)
-    ON DELETE CASCADE
-);"""
-  result = db.execute(sql)
-
-def set_session():
-  global Session
-  db_engine = sqlalchemy.create_engine(f'sqlite:///{NOTEBOOK_PATH}/catalog.sqlite', convert_unicode=True)
-  Session = sqlalchemy.orm.sessionmaker(bind=db_engine)
-
-def init_notebook():
-  ## create the default notebook if it doesn't exist
-  if not os.path.exists(NOTEBOOK_PATH):
-    os.mkdir(NOTEBOOK_PATH)
-    if not os.path.exists(NOTEBOOK_PATH):
-      info ('Unable to create default notebook.', level='error')
-      sys.exit(1)
-  if not os.path.exists(NOTEBOOK_PATH+'/images'):
-    os.mkdir(NOTEBOOK_PATH+'/images')
-  if not os.path.exists(NOTEBOOK_PATH+'/catalog.sqlite'):
-    init_sql(NOTEBOOK_PATH)
-  if not Session:
-    set_session()
-  ## make sure our cwd is the path of the notebook
-  os.chdir(NOTEBOOK_PATH)
-
 def save_settings():
   with open(SETTINGS, 'w') as fp:
     json.dump(settings, fp)
@@ -1202,7 +2159,26 @@ if __name__ == '__main__':
   ## parse arguments
   parser = argparse.ArgumentParser(description='Redteam Notebook')
   parser.add_argument('--debug', dest='debug', action='store_true', help='enable debug messages')
+  parser.add_argument('--doc-cache', dest='doc_cache', type=int, default=DOC_CACHE_SIZE, help='number of parsed notes to keep in memory')
+  parser.add_argument('--image-cache', dest='image_cache', type=int, default=IMAGE_CACHE_SIZE // (1024 * 1024), help='MiB of scaled note images to keep in memory')
+  parser.add_argument('--image-disk-cache', dest='image_disk_cache', action='store_true', help='also keep scaled note images in the notebook, under thumbs/')
+  parser.add_argument('--import-jobs', dest='import_jobs', type=int, default=IMPORT_JOBS, help='number of processes parsing nmap reports')
+  parser.add_argument('--import-jobs-per-notebook', dest='import_jobs_per_notebook', type=int, default=0, help='most of those processes one notebook may use at once (default: all)')
+  parser.add_argument('--image-jobs-per-notebook', dest='image_jobs_per_notebook', type=int, default=IMAGE_JOBS_PER_NOTEBOOK, help='number of threads storing one notebook\'s pasted images')
+  parser.add_argument('--lazy-tree', dest='lazy_tree', action='store_true', help=f'only load tree branches when they are expanded, or when the filter matches a node in them (the first {LAZY_FILTER_LIMIT} matches)')
+  parser.add_argument('--notebook-cache', dest='notebook_cache', type=int, default=NOTEBOOK_CACHE_SIZE, help='number of recently used notebooks to keep open')
+  parser.add_argument('--notebook-cache-memory', dest='notebook_cache_memory', type=int, default=NOTEBOOK_CACHE_MEMORY // (1024 * 1024), help='MiB the recently used notebooks may hold')
   args = parser.parse_args()
+  notebook.DEBUG = args.debug
+  DOC_CACHE_SIZE = args.doc_cache
+  IMAGE_CACHE_SIZE = args.image_cache * 1024 * 1024
+  IMAGE_DISK_CACHE = args.image_disk_cache
+  LAZY_TREE = args.lazy_tree
+  NOTEBOOK_CACHE_SIZE = args.notebook_cache
+  NOTEBOOK_CACHE_MEMORY = args.notebook_cache_memory * 1024 * 1024
+  IMPORT_JOBS = args.import_jobs
+  IMPORT_JOBS_PER_NOTEBOOK = args.import_jobs_per_notebook or IMPORT_JOBS
+  IMAGE_JOBS_PER_NOTEBOOK = args.image_jobs_per_notebook
 
   ## load settings
   if not os.path.exists(SETTINGS):
@@ -1212,11 +2188,8 @@ if __name__ == '__main__':
       settings = json.load(fp)
       NOTEBOOK_PATH = settings['last_open_notebook']
 
-  ## get our configs
-  init_notebook()
-  
   app = QApplication(sys.argv)
   app.setApplicationName("Redteam Notebook")
 
-  window = MainWindow()
+  window = MainWindow(NOTEBOOK_PATH)
   app.exec_()
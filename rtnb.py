@@ -0,0 +1,317 @@
+## headless notebook tools, for boxes without a display. this must not import PyQt5, apart from
+## the QImage encoder the gc command loads in its worker processes
+import argparse
+import concurrent.futures
+import hashlib
+import itertools
+import os
+import shutil
+import sys
+import time
+import uuid
+
+import catalog
+import imagestore
+import importer
+import notebook
+
+from notebook import info
+
+IMPORT_BATCH = 2000
+## images younger than this are left alone by gc, as their note may not be saved yet
+GC_MIN_AGE = 3600
+## quality gc re-encodes at, unless --quality is given
+REENCODE_QUALITY = 85
+
+def find_parent(db, parent):
+  ## a parent is either a node id, or a /-separated path of node names from a root node.
+  ## missing path components are created, so a fresh notebook can be imported into
+  if db.query(catalog.NodeGraph).get(parent):
+    return parent
+  parentid = None
+  for name in [name for name in parent.split('/') if name]:
+    node = db.query(catalog.NodeGraph).filter(catalog.NodeGraph.parentid == parentid, catalog.NodeGraph.basename == name).first()
+    if not node:
+      info (f'Creating node "{name}"', level='info')
+      node = catalog.NodeGraph()
+      node.nodeid = uuid.uuid4().hex
+      node.parentid = parentid
+      node.basename = name
+      db.add(node)
+      db.flush()
+      catalog.index_new_nodes(db)
+      db.commit()
+    parentid = node.nodeid
+  return parentid
+
+def read_hosts(filenames, jobs):
+  ## a single report is streamed, several are parsed in parallel
+  if len(filenames) == 1:
+    with open(filenames[0], 'rb') as fp:
+      yield from importer.iter_hosts(fp)
+    return
+  with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(filenames))) as pool:
+    futures = [pool.submit(importer.parse_file, filename) for filename in filenames]
+    for future in concurrent.futures.as_completed(futures):
+      yield from future.result()
+
+def import_nmap(args):
+  for filename in args.files:
+    if not os.path.exists(filename):
+      info (f'Unable to open file {filename}!', level='error')
+      return 1
+
+  notebook.init_notebook(args.notebook)
+  Session = notebook.create_session(args.notebook)
+  db = Session()
+  parentid = find_parent(db, args.parent)
+  index = importer.ScanIndex(db, parentid) if args.merge else None
+
+  start = time.perf_counter()
+  count = 0
+  written = 0
+  batch = []
+  for host in read_hosts(args.files, args.jobs):
+    batch.append(host)
+    count += 1
+    if len(batch) == IMPORT_BATCH:
+      written += write_batch(db, batch, parentid, index)
+      batch = []
+  written += write_batch(db, batch, parentid, index)
+  db.close()
+  notebook.close_engine(args.notebook)
+
+  info (f'Imported {count} host(s), {written} node(s) written in {time.perf_counter() - start:.2f}s', level='info')
+  return 0
+
+def write_batch(db, hosts, parentid, index):
+  if index:
+    nodes, updates = importer.merge_nodes(hosts, parentid, index)
+  else:
+    nodes, updates = importer.scan_nodes(hosts, parentid), []
+  importer.write_nodes(db, nodes, [new for old, new in updates])
+  return len(nodes) + len(updates)
+
+def collect_garbage(args):
+  ## the notebook should be closed while this runs: an open editor may still hold references
+  ## that are not saved, or undo history that brings a removed image back
+  if not os.path.exists(notebook.catalog_file(args.notebook)):
+    info (f'Unable to find a notebook at {args.notebook}!', level='error')
+    return 1
+  notebook.init_notebook(args.notebook)
+  Session = notebook.create_session(args.notebook)
+  db = Session()
+  store = imagestore.open_store(args.notebook)
+
+  start = time.perf_counter()
+  references = catalog.image_references(db)
+  cutoff = time.time() - args.min_age
+  removed = 0
+  reclaimed = 0
+  for name, size, mtime in list(store.names()):
+    ## this also sweeps up staging files left behind by a crash, once they are old enough
+    if name in references or mtime > cutoff:
+      continue
+    info (f'{"Would remove" if args.dry_run else "Removing"} {name} ({size} bytes)', level='debug')
+    if not args.dry_run:
+      store.remove(name)
+    removed += 1
+    reclaimed += size
+  info (f'{"Would remove" if args.dry_run else "Removed"} {removed} unused image(s), {reclaimed} bytes', level='info')
+
+  if args.reencode_over:
+    reclaimed += reencode_images(db, store, args, references)
+  store.close()
+
+  ## a packed notebook only gives the space back once it is vacuumed. that may renumber
+  ## node rowids, which the search index shares
+  if store.packed and reclaimed and not args.dry_run:
+    info ('Vacuuming...', level='info')
+    db.execute('VACUUM')
+    catalog.rebuild_search(db)
+    db.commit()
+  db.close()
+  notebook.close_engine(args.notebook)
+
+  ## scaled images are a cache, keyed by the image name, so they are rebuilt as needed
+  thumbs = os.path.join(args.notebook, 'thumbs')
+  if args.thumbs and os.path.isdir(thumbs):
+    size = sum(entry.stat().st_size for entry in os.scandir(thumbs) if entry.is_file())
+    if not args.dry_run:
+      shutil.rmtree(thumbs)
+    info (f'{"Would clear" if args.dry_run else "Cleared"} {size} bytes of scaled images', level='info')
+    reclaimed += size
+
+  info (f'{"Would reclaim" if args.dry_run else "Reclaimed"} {reclaimed} bytes in {time.perf_counter() - start:.2f}s', level='info')
+  return 0
+
+def reencode_image(path, name, format, quality, max_width, dry_run, requality=False):
+  ## runs in a worker process, with its own store. returns (old name, new name, old size,
+  ## new size), with no new name if the image did not get any smaller
+  store = imagestore.open_store(path)
+  try:
+    data = store.get(name)
+    ## encoding a jpeg or webp again in its own format only loses detail, so that is left to
+    ## images that are scaled down, or when a quality was asked for. png is lossless
+    extensions = ('.jpg', '.jpeg') if format == 'jpeg' else ('.' + format,)
+    if format != 'png' and os.path.splitext(name)[1].lower() in extensions and not requality:
+      if not max_width or imagestore.image_width(data) <= max_width:
+        return name, None, len(data), len(data)
+    new_data = imagestore.reencode(data, format, quality, max_width)
+    if new_data is None or len(new_data) >= len(data):
+      return name, None, len(data), len(data)
+    ext = 'jpg' if format == 'jpeg' else format
+    if dry_run:
+      return name, f'{hashlib.md5(new_data).hexdigest()}.{ext}', len(data), len(new_data)
+    ## names are content hashes, so writing from several processes at once is safe
+    new_name = store.put(new_data, ext)
+    return name, os.path.basename(new_name), len(data), len(new_data)
+  finally:
+    store.close()
+
+def reencode_images(db, store, args, references):
+  ## re-encoding changes an image's hash and so its name. notes are pointed at the new name
+  ## before the old image goes, so a crash part way through never leaves a missing image
+  names = [name for name, size, mtime in store.names() if name in references and size > args.reencode_over]
+  quality = REENCODE_QUALITY if args.quality is None else args.quality
+
+  renames = {}
+  saved = 0
+  repeat = itertools.repeat
+  with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+    for name, new_name, size, new_size in pool.map(reencode_image, repeat(args.notebook), names, repeat(args.format), repeat(quality), repeat(args.max_width), repeat(args.dry_run), repeat(args.quality is not None)):
+      if new_name:
+        info (f'{"Would re-encode" if args.dry_run else "Re-encoded"} {name} ({size} -> {new_size} bytes)', level='debug')
+        renames[name] = new_name
+        saved += size - new_size
+  info (f'{"Would re-encode" if args.dry_run else "Re-encoded"} {len(renames)} of {len(names)} large image(s), {saved} bytes', level='info')
+  if args.dry_run or not renames:
+    return saved
+
+  nodeids = set().union(*(references[name] for name in renames))
+  for nodeid in nodeids:
+    content, hashes = catalog.load_note(db, nodeid)
+    content = catalog.IMAGE_REF.sub(lambda match: 'images/' + renames.get(match.group(1), match.group(1)), content)
+    notebook.write_note(db, nodeid, content, time.time(), catalog.split_chunks(content), hashes)
+  db.commit()
+  info (f'Updated {len(nodeids)} note(s)', level='info')
+  for name in renames:
+    store.remove(name)
+  return saved
+
+def pack_notebook(args):
+  ## copy a notebook directory into a single packed file. the directory is left as it was
+  target = os.path.abspath(os.path.expanduser(args.target))
+  if notebook.is_packed(args.notebook) or not os.path.exists(notebook.catalog_file(args.notebook)):
+    info (f'Unable to find a notebook directory at {args.notebook}!', level='error')
+    return 1
+  if os.path.exists(target):
+    info (f'{target} already exists!', level='error')
+    return 1
+
+  start = time.perf_counter()
+  notebook.migrate(args.notebook)
+  notebook.close_engine(args.notebook)
+  notebook.copy_catalog(notebook.catalog_file(args.notebook), target)
+  notebook.init_notebook(target)
+  notebook.close_engine(target)
+
+  source = imagestore.open_store(args.notebook)
+  store = imagestore.open_store(target)
+  count = 0
+  size = 0
+  def images():
+    nonlocal count, size
+    for name, length, mtime in source.names():
+      if name.startswith('.'):
+        continue
+      count += 1
+      size += length
+      yield name, mtime, source.get(name)
+  store.add(images())
+  store.close()
+  info (f'Packed {count} image(s), {size} bytes, into {target} in {time.perf_counter() - start:.2f}s', level='info')
+  return 0
+
+def unpack_notebook(args):
+  ## copy a packed notebook out into a notebook directory. the packed file is left as it was
+  target = os.path.abspath(os.path.expanduser(args.target))
+  if not os.path.isfile(args.notebook):
+    info (f'Unable to find a packed notebook at {args.notebook}!', level='error')
+    return 1
+  if os.path.exists(target):
+    info (f'{target} already exists!', level='error')
+    return 1
+
+  start = time.perf_counter()
+  notebook.init_notebook(args.notebook)
+  notebook.close_engine(args.notebook)
+  os.mkdir(target)
+  os.mkdir(os.path.join(target, 'images'))
+  notebook.copy_catalog(args.notebook, notebook.catalog_file(target))
+
+  source = imagestore.open_store(args.notebook)
+  count = 0
+  size = 0
+  for name, mtime, data in source.items():
+    path = os.path.join(target, 'images', name)
+    with open(path, 'wb') as fp:
+      fp.write(data)
+    os.utime(path, (mtime, mtime))
+    count += 1
+    size += len(data)
+  source.close()
+
+  ## the copied catalog still holds every image. vacuuming it may renumber node rowids,
+  ## which the search index shares
+  Session = notebook.create_session(target)
+  db = Session()
+  db.execute('DROP TABLE images')
+  db.commit()
+  db.execute('VACUUM')
+  catalog.rebuild_search(db)
+  db.commit()
+  db.close()
+  notebook.close_engine(target)
+  info (f'Unpacked {count} image(s), {size} bytes, into {target} in {time.perf_counter() - start:.2f}s', level='info')
+  return 0
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Redteam Notebook headless tools')
+  parser.add_argument('--debug', dest='debug', action='store_true', help='enable debug messages')
+  commands = parser.add_subparsers(dest='command', required=True)
+
+  command = commands.add_parser('import', help='import nmap xml reports into a notebook')
+  command.add_argument('notebook', help=f'notebook directory, or packed notebook ending in {notebook.PACK_EXT}, created if it does not exist')
+  command.add_argument('files', nargs='+', help='nmap xml reports')
+  command.add_argument('--parent', default='Scans', help='node id, or /-separated path of node names to import under (default: Scans)')
+  command.add_argument('--merge', action='store_true', help='merge into the hosts and ports already under the parent')
+  command.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='number of processes parsing reports')
+  command.set_defaults(func=import_nmap)
+
+  command = commands.add_parser('gc', help='remove images no note uses, and optionally shrink large ones')
+  command.add_argument('notebook', help='notebook directory or packed notebook, which should not be open while this runs')
+  command.add_argument('--dry-run', action='store_true', help='only report what would be removed or re-encoded')
+  command.add_argument('--min-age', type=int, default=GC_MIN_AGE, help=f'seconds an unused image must be old before it is removed (default: {GC_MIN_AGE})')
+  command.add_argument('--reencode-over', type=int, default=0, metavar='BYTES', help='re-encode images larger than this')
+  command.add_argument('--format', choices=['jpeg', 'webp', 'png'], default='jpeg', help='format to re-encode to (default: jpeg)')
+  command.add_argument('--quality', type=int, help=f're-encode quality, 0-100 (default: {REENCODE_QUALITY}). when given, images already in the format are encoded again too')
+  command.add_argument('--max-width', type=int, default=0, help='also scale re-encoded images down to this width, including images already in the format')
+  command.add_argument('--thumbs', action='store_true', help='also clear the scaled images kept under thumbs/')
+  command.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='number of processes re-encoding images')
+  command.set_defaults(func=collect_garbage)
+
+  command = commands.add_parser('pack', help='copy a notebook directory into a single packed file')
+  command.add_argument('notebook', help='notebook directory')
+  command.add_argument('target', help=f'packed notebook to create, usually ending in {notebook.PACK_EXT}')
+  command.set_defaults(func=pack_notebook)
+
+  command = commands.add_parser('unpack', help='copy a packed notebook out into a notebook directory')
+  command.add_argument('notebook', help='packed notebook')
+  command.add_argument('target', help='notebook directory to create')
+  command.set_defaults(func=unpack_notebook)
+
+  args = parser.parse_args()
+  notebook.DEBUG = args.debug
+  args.notebook = os.path.abspath(os.path.expanduser(args.notebook))
+  sys.exit(args.func(args))
@@ -0,0 +1,62 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import catalog
+import notebook
+
+class CatalogTestCase(unittest.TestCase):
+  ## a fresh notebook, with a session on its catalog
+  def setUp(self):
+    self.workdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.workdir, 'test.notebook')
+    notebook.init_notebook(self.path)
+    self.db = notebook.create_session(self.path)()
+
+  def tearDown(self):
+    self.db.close()
+    notebook.close_engine(self.path)
+    shutil.rmtree(self.workdir, ignore_errors=True)
+
+  def add_nodes(self, *nodes):
+    for nodeid, parentid in nodes:
+      self.db.add(catalog.NodeGraph(nodeid=nodeid, parentid=parentid, basename=nodeid))
+    self.db.commit()
+
+  def nodeids(self):
+    return sorted(row.nodeid for row in self.db.query(catalog.NodeGraph.nodeid))
+
+class SubtreeTest(CatalogTestCase):
+  def test_delete_subtree_takes_notes_and_chunks(self):
+    self.add_nodes(('a', None), ('b', 'a'), ('c', 'b'), ('d', None))
+    big = '\n\n'.join(f'paragraph {i} ' + 'text ' * 400 for i in range(50))
+    notebook.write_note(self.db, 'c', big, 0, catalog.split_chunks(big), None)
+    notebook.write_note(self.db, 'd', 'kept', 0, None, None)
+    self.db.commit()
+
+    catalog.delete_subtree(self.db, 'a')
+    self.db.commit()
+    self.assertEqual(self.nodeids(), ['d'])
+    self.assertEqual([row.nodeid for row in self.db.query(catalog.Note.nodeid)], ['d'])
+    self.assertEqual(self.db.query(catalog.NoteChunk).count(), 0)
+
+  def test_delete_subtrees_survives_a_cycle(self):
+    self.add_nodes(('a', 'c'), ('b', 'a'), ('c', 'b'), ('d', None))
+    catalog.delete_subtrees(self.db, ['a'])
+    self.db.commit()
+    self.assertEqual(self.nodeids(), ['d'])
+
+  def test_ancestors(self):
+    self.add_nodes(('a', None), ('b', 'a'), ('c', 'b'))
+    self.assertEqual(catalog.ancestors(self.db, 'c'), ['a', 'b', 'c'])
+
+  def test_ancestors_survives_a_cycle(self):
+    self.add_nodes(('a', 'c'), ('b', 'a'), ('c', 'b'), ('d', 'c'))
+    self.assertEqual(catalog.ancestors(self.db, 'd'), ['a', 'b', 'c', 'd'])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,41 @@
+import os
+import sys
+import unittest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtGui import QTextDocument
+from PyQt5.QtWidgets import QApplication
+
+import redteamnotebook
+
+app = QApplication.instance() or QApplication(sys.argv)
+
+class DocumentCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.flushed = []
+    self.cache = redteamnotebook.DocumentCache(2, self.load, lambda uuid, doc: self.flushed.append((uuid, doc.toPlainText())))
+
+  def load(self, uuid):
+    doc = QTextDocument(uuid)
+    doc.setModified(False)
+    return doc
+
+  def test_evicts_least_recently_used(self):
+    self.cache.get('a')
+    self.cache.get('b')
+    self.cache.get('a')
+    self.cache.get('c')
+    self.assertEqual(self.cache.uuids(), ['a', 'c'])
+    self.assertEqual(self.flushed, [])
+
+  def test_evicting_modified_doc_flushes_it(self):
+    self.cache.get('a').setPlainText('edited')
+    self.cache.get('b')
+    self.cache.get('c')
+    self.assertNotIn('a', self.cache.uuids())
+    self.assertEqual(self.flushed, [('a', 'edited')])
+
+if __name__ == '__main__':
+  unittest.main()
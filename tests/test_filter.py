@@ -0,0 +1,43 @@
+import os
+import sys
+import unittest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtGui import QStandardItem, QStandardItemModel
+from PyQt5.QtWidgets import QApplication
+
+import importer
+import redteamnotebook
+
+app = QApplication.instance() or QApplication(sys.argv)
+
+class TreeFilterTest(unittest.TestCase):
+  def setUp(self):
+    self.model = QStandardItemModel()
+    for address in ('22.1.2.3', '10.0.0.1'):
+      host = QStandardItem(address)
+      for protocol, port in (('tcp', 22), ('tcp', 2222), ('udp', 22), ('tcp', 80)):
+        host.appendRow(QStandardItem(importer.port_label(protocol, port, 'open')))
+      self.model.appendRow(host)
+    self.filter = redteamnotebook.TreeFilterModel()
+    self.filter.setSourceModel(self.model)
+
+  def matches(self, text):
+    self.filter.set_filter(text)
+    labels = []
+    for row in range(self.filter.rowCount()):
+      host = self.filter.index(row, 0)
+      for child in range(self.filter.rowCount(host)):
+        labels.append(self.filter.index(child, 0, host).data())
+    return labels
+
+  def test_port_filter_matches_only_ports(self):
+    self.assertEqual(self.matches('port:22'), ['22 tcp [open]', '22 udp [open]'] * 2)
+
+  def test_port_filter_with_protocol(self):
+    self.assertEqual(self.matches('port:22/udp'), ['22 udp [open]'] * 2)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,163 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtCore import QMimeData, QUrl
+from PyQt5.QtGui import QColor, QImage, QTextCursor, QTextDocument
+from PyQt5.QtWidgets import QApplication
+
+import catalog
+import redteamnotebook
+
+app = QApplication.instance() or QApplication(sys.argv)
+
+class GatedStore():
+  ## holds image jobs until the test lets them finish
+  def __init__(self, store):
+    self.store = store
+    self.gate = threading.Event()
+
+  def put(self, data, ext='png'):
+    self.gate.wait(30)
+    return self.store.put(data, ext)
+
+  def __getattr__(self, name):
+    return getattr(self.store, name)
+
+class PendingImageTest(unittest.TestCase):
+  def setUp(self):
+    self.workdir = tempfile.mkdtemp()
+    self.window = redteamnotebook.MainWindow(os.path.join(self.workdir, 'test.notebook'))
+
+  def tearDown(self):
+    self.window.close()
+    shutil.rmtree(self.workdir, ignore_errors=True)
+
+  def select(self, name):
+    window = self.window
+    item = window.treeModel.findItems(name)[0]
+    window.treeView.setCurrentIndex(window.view_index(item))
+    window.fetch_note(None)
+    return item.data(redteamnotebook.ROLE_NODE_UUID)
+
+  def paste_image(self):
+    window = self.window
+    image = QImage(64, 32, QImage.Format_RGB32)
+    image.fill(QColor('red'))
+    source = QMimeData()
+    source.setImageData(image)
+    window.editor.insertFromMimeData(source)
+    self.assertTrue(window.editor.pending_images)
+
+  def finish_images(self):
+    window = self.window
+    self.images.gate.set()
+    started = time.monotonic()
+    while window.editor.pending_images and time.monotonic() - started < 30:
+      app.processEvents()
+      time.sleep(0.01)
+    self.assertFalse(window.editor.pending_images)
+    window.flush_writes()
+
+  def catalog_note(self, nodeid):
+    with self.window.nb.repo.session() as db:
+      return catalog.load_note(db, nodeid)[0] or ''
+
+  def add_notes(self, *names):
+    for name in names:
+      self.window.add_root_node(name=name)
+    self.images = self.window.nb.images = GatedStore(self.window.nb.images)
+
+  def test_image_stored_after_switching_notes(self):
+    self.add_notes('first', 'second')
+    nodeid = self.select('first')
+    self.window.editor.insertPlainText('before the image\n')
+    self.paste_image()
+
+    ## leave the note while its image is still being stored
+    self.select('second')
+    self.finish_images()
+
+    content = self.catalog_note(nodeid)
+    self.assertIn('before the image', content)
+    self.assertNotIn('pending-image:', content)
+    self.assertRegex(content, r'images/[0-9a-f]{32}\.png')
+
+  def test_note_with_pending_image_stays_cached(self):
+    self.add_notes('first', 'second', 'third', 'fourth')
+    self.window.docs.size = 2
+    nodeid = self.select('first')
+    self.window.editor.insertPlainText('before the image\n')
+    self.paste_image()
+    doc = self.window.editor.document()
+
+    ## open enough notes to push it out of the cache, then come back and edit it again
+    for name in ('second', 'third', 'fourth'):
+      self.select(name)
+    self.assertIs(self.window.docs.peek(nodeid), doc)
+    self.select('first')
+    self.assertIs(self.window.editor.document(), doc)
+    self.window.editor.moveCursor(QTextCursor.End)
+    self.window.editor.insertPlainText('after the image')
+    self.select('second')
+    self.finish_images()
+
+    content = self.catalog_note(nodeid)
+    self.assertIn('before the image', content)
+    self.assertIn('after the image', content)
+    self.assertNotIn('pending-image:', content)
+    self.assertRegex(content, r'images/[0-9a-f]{32}\.png')
+
+  def test_stale_doc_is_not_saved(self):
+    self.add_notes('first', 'second')
+    nodeid = self.select('first')
+    self.window.editor.insertPlainText('before the image\n')
+    self.paste_image()
+    self.select('second')
+
+    ## the note is reloaded from the catalog and edited while the old doc's image is pending
+    self.window.docs.discard(nodeid)
+    self.select('first')
+    self.window.editor.insertPlainText('newer edit')
+    self.select('second')
+    self.finish_images()
+
+    content = self.catalog_note(nodeid)
+    self.assertIn('newer edit', content)
+    self.assertNotIn('before the image', content)
+    self.assertNotIn('pending-image:', content)
+
+class PrintTest(unittest.TestCase):
+  def setUp(self):
+    self.workdir = tempfile.mkdtemp()
+    self.window = redteamnotebook.MainWindow(os.path.join(self.workdir, 'test.notebook'))
+
+  def tearDown(self):
+    self.window.close()
+    shutil.rmtree(self.workdir, ignore_errors=True)
+
+  def test_print_uses_full_size_images(self):
+    window = self.window
+    window.add_root_node(name='note')
+    image = QImage(3000, 100, QImage.Format_RGB32)
+    image.fill(QColor('blue'))
+    name = window.nb.images.put(redteamnotebook.encode_png(image))
+    nodeid = window.get_nodeid()
+    window.nb.repo.save_note(nodeid, f'![image]({name})\n')
+    window.fetch_note(None)
+
+    url = QUrl(name)
+    shown = window.editor.document().resource(QTextDocument.ImageResource, url)
+    self.assertLess(shown.width(), 3000)
+    printed = window.print_document().resource(QTextDocument.ImageResource, url)
+    self.assertEqual(printed.width(), 3000)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,34 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import imagestore
+
+class ImageStoreTest(unittest.TestCase):
+  def setUp(self):
+    self.workdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.workdir, ignore_errors=True)
+
+  def test_stored_image_mode_follows_umask(self):
+    store = imagestore.ImageStore(self.workdir)
+    name = store.put(b'not really a png')
+    mode = stat.S_IMODE(os.stat(os.path.join(self.workdir, os.path.basename(name))).st_mode)
+    umask = os.umask(0o022)
+    os.umask(umask)
+    self.assertEqual(mode, 0o666 & ~umask)
+
+  def test_same_image_is_stored_once(self):
+    store = imagestore.ImageStore(self.workdir)
+    self.assertEqual(store.put(b'image'), store.put(b'image'))
+    self.assertEqual(len(list(store.names())), 1)
+    self.assertEqual(store.hits, 1)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,80 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import catalog
+import importer
+import notebook
+
+def scan_host(address, services):
+  return {'address': address, 'up': True, 'hostnames': [], 'osfamilies': ['Linux'], 'services': services}
+
+class ImporterTestCase(unittest.TestCase):
+  ## a notebook with a single 'scans' node to import into
+  def setUp(self):
+    self.workdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.workdir, 'test.notebook')
+    notebook.init_notebook(self.path)
+    self.repo = notebook.Repository(self.path)
+    self.repo.add_node('scans', None, 'scans')
+
+  def tearDown(self):
+    self.repo.close()
+    shutil.rmtree(self.workdir, ignore_errors=True)
+
+  def merge(self, hosts):
+    with self.repo.session() as db:
+      nodes, updates = importer.merge_nodes(hosts, 'scans', importer.ScanIndex(db, 'scans'))
+      importer.write_nodes(db, nodes, [new for _, new in updates])
+    return nodes, updates
+
+  def labels(self):
+    with self.repo.session() as db:
+      return sorted(db.query(catalog.NodeGraph.basename, catalog.NodeGraph.icon).filter(catalog.NodeGraph.nodeid != 'scans').all())
+
+class MergeTest(ImporterTestCase):
+  def setUp(self):
+    super().setUp()
+    self.hosts = [scan_host('10.0.0.1', [('tcp', 22, 'open'), ('tcp', 80, 'closed')]), scan_host('10.0.0.2', [('udp', 53, 'open')])]
+
+  def test_merging_same_scan_twice_adds_nothing(self):
+    nodes, updates = self.merge(self.hosts)
+    self.assertEqual(len(nodes), 7)
+    labels = self.labels()
+    self.assertEqual(self.merge(self.hosts), ([], []))
+    self.assertEqual(self.labels(), labels)
+
+  def test_merge_updates_changed_port_in_place(self):
+    self.merge(self.hosts)
+    self.hosts[0]['services'][1] = ('tcp', 80, 'open')
+    nodes, updates = self.merge(self.hosts)
+    self.assertEqual(nodes, [])
+    self.assertEqual([(old.basename, new.basename) for old, new in updates], [('80 tcp [closed]', '80 tcp [open]')])
+    self.assertIn(('80 tcp [open]', 'stat_green.png'), self.labels())
+    self.assertNotIn(('80 tcp [closed]', 'stat_red.png'), self.labels())
+
+class RollbackTest(ImporterTestCase):
+  def test_rollback_removes_import_and_restores_updates(self):
+    self.merge([scan_host('10.0.0.1', [('tcp', 22, 'closed')])])
+    before = self.labels()
+
+    nodes, updates = self.merge([scan_host('10.0.0.1', [('tcp', 22, 'open')]), scan_host('10.0.0.2', [('tcp', 80, 'open')])])
+    new_host = nodes[0].nodeid
+    ## notes and nodes added under the import while it ran go with it
+    self.repo.add_node('added', nodes[-1].nodeid, 'added')
+    self.repo.save_note(nodes[-1].nodeid, 'note on an imported port')
+    self.repo.save_note('added', 'note on an added node')
+    self.repo.flush()
+
+    with self.repo.session() as db:
+      importer.remove_subtrees(db, [new_host])
+      importer.write_nodes(db, [], [old for old, _ in updates])
+      self.assertEqual(db.query(catalog.Note).count(), 0)
+    self.assertEqual(self.labels(), before)
+
+if __name__ == '__main__':
+  unittest.main()
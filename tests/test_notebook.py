@@ -0,0 +1,140 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import catalog
+import notebook
+
+class NotebookTestCase(unittest.TestCase):
+  ## a fresh notebook with a single node, 'node', and a repository on it
+  def setUp(self):
+    self.workdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.workdir, 'test.notebook')
+    notebook.init_notebook(self.path)
+    self.repo = notebook.Repository(self.path)
+    self.repo.add_node('node', None, 'node')
+    self.repo.flush()
+
+  def tearDown(self):
+    self.repo.close()
+    shutil.rmtree(self.workdir, ignore_errors=True)
+
+  def catalog_note(self):
+    with self.repo.session() as db:
+      return catalog.load_note(db, 'node')[0]
+
+class FailedSaveTest(NotebookTestCase):
+  def test_failed_save_is_retried(self):
+    writer = self.repo.writer
+    write = writer.write
+    def fail(db, path, jobs):
+      raise OSError('disk full')
+    writer.write = fail
+    try:
+      self.repo.save_note('node', 'first edit')
+      self.repo.flush()
+    finally:
+      writer.write = write
+
+    ## nothing was committed, so the note must not count as saved
+    self.assertIn('node', self.repo.failed)
+    self.assertNotEqual(self.repo.saved.get('node'), catalog.content_hash('first edit'))
+    self.assertEqual(self.repo.load_note('node'), 'first edit')
+
+    self.repo.flush()
+    self.assertFalse(self.repo.failed)
+    self.assertEqual(self.catalog_note(), 'first edit')
+    self.assertEqual(self.repo.saved.get('node'), catalog.content_hash('first edit'))
+
+  def test_newer_save_replaces_failed_one(self):
+    writer = self.repo.writer
+    write = writer.write
+    def fail(db, path, jobs):
+      raise OSError('disk full')
+    writer.write = fail
+    try:
+      self.repo.save_note('node', 'first edit')
+      self.repo.flush()
+    finally:
+      writer.write = write
+
+    self.repo.save_note('node', 'second edit')
+    self.repo.flush()
+    self.assertFalse(self.repo.failed)
+    self.assertEqual(self.catalog_note(), 'second edit')
+
+class ChunkTest(NotebookTestCase):
+  def setUp(self):
+    super().setUp()
+    self.paragraphs = [f'paragraph {i} ' + 'text ' * 400 for i in range(100)]
+
+  def chunk_hashes(self):
+    with self.repo.session() as db:
+      return {row.hash for row in db.query(catalog.NoteChunk.hash).filter_by(nodeid='node')}
+
+  def test_split_chunks_reassemble(self):
+    self.assertIsNone(catalog.split_chunks('small note'))
+    content = '\n\n'.join(self.paragraphs)
+    chunks = catalog.split_chunks(content)
+    self.assertGreater(len(chunks), 1)
+    self.assertEqual(''.join(chunk for _, chunk in chunks), content)
+    self.assertTrue(all(len(chunk) < catalog.CHUNK_MAX + len(self.paragraphs[0]) + 2 for _, chunk in chunks))
+
+  def test_edit_keeps_later_chunk_boundaries(self):
+    content = '\n\n'.join(self.paragraphs)
+    edited = '\n\n'.join(['changed ' + self.paragraphs[0]] + self.paragraphs[1:])
+    before = [h for h, _ in catalog.split_chunks(content)]
+    after = [h for h, _ in catalog.split_chunks(edited)]
+    self.assertNotEqual(before[0], after[0])
+    self.assertEqual(before[1:], after[1:])
+
+  def test_saved_chunks_round_trip(self):
+    ## repeated paragraphs give repeated chunks, which are only stored once
+    content = '\n\n'.join(self.paragraphs + self.paragraphs[:10])
+    self.repo.save_note('node', content)
+    self.assertEqual(self.catalog_note(), content)
+    self.assertEqual(self.chunk_hashes(), {h for h, _ in catalog.split_chunks(content)})
+
+    ## an edit replaces the chunks it touched, and drops the ones nothing uses any more
+    edited = '\n\n'.join(['changed ' + self.paragraphs[0]] + self.paragraphs[1:])
+    self.repo.save_note('node', edited)
+    self.assertEqual(self.catalog_note(), edited)
+    self.assertEqual(self.chunk_hashes(), {h for h, _ in catalog.split_chunks(edited)})
+
+    self.repo.save_note('node', 'small again')
+    self.assertEqual(self.catalog_note(), 'small again')
+    self.assertEqual(self.chunk_hashes(), set())
+
+class DeleteSubtreeTest(NotebookTestCase):
+  def test_delete_takes_queued_nodes_and_notes(self):
+    self.repo.add_node('child', 'node', 'child')
+    self.repo.add_node('other', None, 'other')
+    self.repo.flush()
+    self.repo.save_note('child', 'child note')
+    ## still queued when the delete comes in
+    self.repo.add_node('grandchild', 'child', 'grandchild')
+    self.repo.delete_subtree('node')
+    with self.repo.session() as db:
+      self.assertEqual([row.nodeid for row in db.query(catalog.NodeGraph.nodeid)], ['other'])
+      self.assertEqual(db.query(catalog.Note).count(), 0)
+
+class SearchTextTest(NotebookTestCase):
+  def test_chunked_note_is_indexed_in_order(self):
+    ## repeated paragraphs give repeated chunks, which are only stored once
+    paragraphs = [f'paragraph {i} ' + 'text ' * 400 for i in range(100)]
+    content = '\n\n'.join(paragraphs + paragraphs[:10])
+    self.assertTrue(catalog.split_chunks(content))
+    self.repo.save_note('node', content)
+    with self.repo.session() as db:
+      indexed = db.execute(catalog.text("SELECT content FROM search WHERE rowid = (SELECT rowid FROM node_graph WHERE nodeid = 'node')")).scalar()
+      self.assertEqual(indexed, content)
+      catalog.rebuild_search(db)
+      indexed = db.execute(catalog.text("SELECT content FROM search WHERE rowid = (SELECT rowid FROM node_graph WHERE nodeid = 'node')")).scalar()
+      self.assertEqual(indexed, content)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,69 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtWidgets import QApplication
+
+import notebook
+import redteamnotebook
+
+app = QApplication.instance() or QApplication(sys.argv)
+
+class NotebookCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.workdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.workdir, ignore_errors=True)
+
+  def state(self, name):
+    return redteamnotebook.NotebookState(os.path.join(self.workdir, f'{name}.notebook'))
+
+  def test_oldest_notebook_is_closed(self):
+    cache = redteamnotebook.NotebookCache(2, 1 << 40)
+    states = [self.state(name) for name in ('a', 'b', 'c')]
+    for state in states:
+      state.repo.add_node('node', None, 'node')
+      cache.put(state)
+    self.assertEqual(len(cache), 2)
+    ## the oldest was closed, after its queued writes were committed
+    self.assertNotIn(states[0].path, notebook.engines)
+    self.assertIsNone(cache.take(states[0].path))
+    self.assertIs(cache.take(states[2].path), states[2])
+    self.assertEqual((cache.hits, cache.misses), (1, 1))
+    reopened = self.state('a')
+    with reopened.repo.session() as db:
+      self.assertEqual(db.query(redteamnotebook.catalog.NodeGraph).count(), 1)
+    reopened.close()
+    cache.put(states[2])
+    cache.clear()
+    self.assertEqual(len(cache), 0)
+
+  def test_memory_limit(self):
+    cache = redteamnotebook.NotebookCache(10, 0)
+    state = self.state('a')
+    cache.put(state)
+    self.assertEqual(len(cache), 0)
+    self.assertNotIn(state.path, notebook.engines)
+
+class LastWindowTest(unittest.TestCase):
+  def test_closing_last_window_stops_writer(self):
+    workdir = tempfile.mkdtemp()
+    try:
+      window = redteamnotebook.MainWindow(os.path.join(workdir, 'test.notebook'))
+      window.add_root_node(name='note')
+      window.nb.repo.save_note(window.get_nodeid(), 'text')
+      writer = notebook.shared_writer()
+      window.close()
+      self.assertFalse(writer.is_alive())
+      self.assertIsNone(notebook.note_writer)
+    finally:
+      shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+  unittest.main()
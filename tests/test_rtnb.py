@@ -0,0 +1,52 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtCore import QBuffer, QIODevice
+from PyQt5.QtGui import QColor, QImage
+
+import imagestore
+import notebook
+import rtnb
+
+def jpeg(width, height):
+  image = QImage(width, height, QImage.Format_RGB32)
+  for x in range(0, width, 4):
+    image.setPixelColor(x, x % height, QColor(x % 255, 80, 160))
+  buffer = QBuffer()
+  buffer.open(QIODevice.WriteOnly)
+  image.save(buffer, 'JPEG', 95)
+  return bytes(buffer.data())
+
+class ReencodeTest(unittest.TestCase):
+  def setUp(self):
+    self.workdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.workdir, 'test.notebook')
+    notebook.init_notebook(self.path)
+    store = imagestore.open_store(self.path)
+    self.name = os.path.basename(store.put(jpeg(2000, 300), 'jpg'))
+
+  def tearDown(self):
+    notebook.close_engine(self.path)
+    shutil.rmtree(self.workdir, ignore_errors=True)
+
+  def test_same_format_left_alone(self):
+    name, new_name, size, new_size = rtnb.reencode_image(self.path, self.name, 'jpeg', 85, 0, True)
+    self.assertIsNone(new_name)
+
+  def test_same_format_scaled_down(self):
+    name, new_name, size, new_size = rtnb.reencode_image(self.path, self.name, 'jpeg', 85, 500, True)
+    self.assertTrue(new_name.endswith('.jpg'))
+    self.assertLess(new_size, size)
+
+  def test_same_format_with_quality(self):
+    name, new_name, size, new_size = rtnb.reencode_image(self.path, self.name, 'jpeg', 40, 0, True, requality=True)
+    self.assertIsNotNone(new_name)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,89 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtWidgets import QApplication
+
+import catalog
+import notebook
+import redteamnotebook
+
+app = QApplication.instance() or QApplication(sys.argv)
+
+class TreeTestCase(unittest.TestCase):
+  ## a notebook holding root > child > grandchild, opened in a window by open_window
+  def setUp(self):
+    self.workdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.workdir, 'test.notebook')
+    self.window = None
+    notebook.init_notebook(self.path)
+    repo = notebook.Repository(self.path)
+    repo.add_node('root', None, 'root')
+    repo.add_node('child', 'root', 'child')
+    repo.add_node('grandchild', 'child', 'grandchild')
+    repo.close()
+
+  def tearDown(self):
+    if self.window:
+      self.window.close()
+    shutil.rmtree(self.workdir, ignore_errors=True)
+
+  def open_window(self):
+    self.window = redteamnotebook.MainWindow(self.path)
+    return self.window
+
+  def basename(self, nodeid):
+    with self.window.nb.repo.session() as db:
+      return db.query(catalog.NodeGraph.basename).filter_by(nodeid=nodeid).scalar()
+
+class LoadTreeTest(TreeTestCase):
+  def test_loaded_grandchild_rename_persists(self):
+    window = self.open_window()
+    item = window.itemFromUUID('grandchild')
+    self.assertIs(item.model(), window.treeModel)
+    window.treeView.setCurrentIndex(window.view_index(item))
+    item.setText('renamed')
+    window.flush_writes()
+    self.assertEqual(self.basename('grandchild'), 'renamed')
+
+class LazyTreeTest(TreeTestCase):
+  def setUp(self):
+    super().setUp()
+    redteamnotebook.LAZY_TREE = True
+
+  def tearDown(self):
+    redteamnotebook.LAZY_TREE = False
+    super().tearDown()
+
+  def test_branches_load_when_expanded(self):
+    window = self.open_window()
+    root = window.itemFromUUID('root')
+    self.assertIsNone(window.itemFromUUID('child'))
+    self.assertTrue(window.treeModel.hasChildren(root.index()))
+    window.show()
+    window.treeView.expand(window.view_index(root))
+    app.processEvents()
+    child = window.itemFromUUID('child')
+    self.assertIsNotNone(child)
+    self.assertIsNone(window.itemFromUUID('grandchild'))
+    self.assertTrue(window.treeModel.canFetchMore(child.index()))
+    window.treeModel.fetchMore(child.index())
+    self.assertFalse(window.treeModel.canFetchMore(child.index()))
+    self.assertEqual(window.itemFromUUID('grandchild').parent(), child)
+
+  def test_filter_fetches_unexpanded_matches(self):
+    window = self.open_window()
+    self.assertIsNone(window.itemFromUUID('grandchild'))
+    window.filter_box.setText('grand')
+    window.filter_tree()
+    item = window.itemFromUUID('grandchild')
+    self.assertIsNotNone(item)
+    self.assertTrue(window.view_index(item).isValid())
+
+if __name__ == '__main__':
+  unittest.main()